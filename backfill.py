@@ -0,0 +1,89 @@
+"""
+# Title : Code Assessment - Backfill
+# Description : Results as of every Cob_date of a range from a single scan of the history
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import logging
+from datetime import date
+from pyspark.sql.functions import when, datediff, date_format, col, lit, coalesce
+from pyspark.sql.functions import min as spark_min
+from pyspark.sql.window import Window
+import datasets
+
+logger = logging.getLogger()
+
+def get_backfill(dataset1, dataset2, attributes, backfill_from, backfill_to):
+    """
+    Returns the results as of every Cob_date of the range from a single scan of the history.
+    The current rows as of a date are the history rows of the keys of the current dataset on that
+    date, and the first Yes dates are the running minimums of the Yes Cob_dates of each key up
+    to that date, the same as a run with that snapshot as the current dataset.
+    """
+    history = datasets.decode_attributes(datasets.filter_history_to(dataset2, backfill_to),
+        attributes).join(dataset1.select("Primary_key"), "Primary_key", how='left_semi')
+    # Range frame so that the rows of a key on the same Cob_date share their running minimums
+    running = Window.partitionBy("Primary_key").orderBy("Cob_date").rangeBetween(
+        Window.unboundedPreceding, Window.currentRow)
+    return (
+        history
+        .select(
+            [col("Primary_key")] + [col(x) for x in attributes] +
+            [col("Cob_date").alias("Current_date")] + [
+                spark_min(when(col(x)=="Yes", col("Cob_date"))).over(running).alias(
+                    datasets.first_yes_column(x))
+                for x in attributes
+            ]
+        )
+        .filter(col("Current_date") >= lit(backfill_from))
+        .select(
+            [col("Primary_key")] + [col(x) for x in attributes] + [col("Current_date")] + [
+                coalesce(datediff(col("Current_date"), col(datasets.first_yes_column(x))),
+                    lit(0)).alias(datasets.days_since_column(x))
+                for x in attributes
+            ]
+        )
+    )
+
+def validate_backfill(args):
+    """
+    Returns True once logged when the backfill dates are invalid or the backfill is requested with
+    options it does not support
+    """
+    if (args.backfill_from is None) != (args.backfill_to is None):
+        logger.info("backfill_from and backfill_to are required together")
+        return True
+    if args.backfill_from is None:
+        return False
+    call_error_found = False
+    try:
+        if date.fromisoformat(args.backfill_from) > date.fromisoformat(args.backfill_to):
+            logger.info("backfill_from is required to be before backfill_to")
+            call_error_found = True
+    except ValueError:
+        logger.info("backfill_from and backfill_to are required to be YYYY-MM-DD dates")
+        call_error_found = True
+    if args.engine != "spark" or args.state_path is not None or args.since is not None \
+        or args.lookback_days is not None:
+        logger.info("backfill is only supported by the spark engine without state_path, "
+            "since or lookback_days")
+        call_error_found = True
+    return call_error_found
+
+def export_backfill(results, result_path, output_format, sort=True):
+    """
+    Exports the backfill results under result_path with one As_of_date partition directory by
+    date holding a single file, sorted by Primary_key unless sort is disabled
+    """
+    results = results.withColumn("As_of_date", col("Current_date")).repartition("As_of_date")
+    results = results.sortWithinPartitions(
+        ["As_of_date", "Primary_key"] if sort else ["As_of_date"])
+    if output_format == "csv":
+        results.withColumn("Current_date",date_format(col("Current_date"),"MM/dd/yyyy"))\
+        .write.options(header='True', dateFormat="MM/dd/yyyy")\
+        .partitionBy("As_of_date").mode("overwrite").csv(result_path)
+        return
+    results.write.partitionBy("As_of_date").mode("overwrite").format(output_format)\
+    .save(result_path)
@@ -0,0 +1,251 @@
+"""
+# Title : Code Assessment - Benchmarks
+# Description : Load test of the creator engines and plans on generated datasets of several sizes
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import textwrap
+import sys
+import os
+import argparse
+import csv
+import json
+import hashlib
+import subprocess
+import time
+from datetime import datetime
+import test_data_generator
+
+BENCH_ROOT = os.path.dirname(os.path.abspath(__file__))
+CREATOR = os.path.join(os.path.dirname(BENCH_ROOT), "creator.py")
+
+# Current keys and history days of each dataset size, the history has keys * (days + 1) rows
+SIZES = {
+    "small": (3000, 14),
+    "medium": (30000, 28),
+    "large": (300000, 84)
+}
+VARIANTS = {
+    "spark-aggregate": ["--engine", "spark", "--plan", "aggregate"],
+    "spark-legacy": ["--engine", "spark", "--plan", "legacy"],
+    "numpy": ["--engine", "numpy"]
+}
+# Seconds between two samples of the resident memory of the creator process tree
+RSS_INTERVAL = 0.1
+
+def parse_input():
+    """
+    Parse script arguments
+    """
+    parser =  argparse.ArgumentParser(
+        prog="benchmarks.run",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+example:
+    # Run every variant on the small and medium datasets and write the report
+    python3 -m benchmarks.run --sizes small,medium
+
+    # Compare the run with the report of a previous commit and fail on a regression
+    python3 -m benchmarks.run --baseline benchmarks/baseline.json
+    ''')
+    )
+
+    parser.add_argument("--sizes", help="Comma separated dataset sizes among "
+        f"{','.join(SIZES)}", default="small,medium", required=False)
+    parser.add_argument("--variants", help="Comma separated engine and plan variants among "
+        f"{','.join(VARIANTS)}", default=",".join(VARIANTS), required=False)
+    parser.add_argument("--data_folder", help="Generated datasets folder",
+        default=os.path.join(BENCH_ROOT, "data"), required=False)
+    parser.add_argument("--report", help="Report file path, written as json and as csv",
+        default=os.path.join(BENCH_ROOT, "report.json"), required=False)
+    parser.add_argument("--baseline", help="Previous report json file to compare the wall "
+        "times with", default=None, required=False)
+    parser.add_argument("--tolerance", help="Wall time ratio to the baseline reported as a "
+        "regression", type=float, default=1.25, required=False)
+    args = parser.parse_args()
+    return args
+
+def main(args):
+    """
+    Generates the datasets, runs the variants and writes the report
+    """
+    records = []
+    for size in args["sizes"]:
+        dataset_folder = generate_dataset(size, args["data_folder"])
+        for variant in args["variants"]:
+            record = run_variant(size, variant, dataset_folder)
+            print(f"{size} {variant}: {record['wall_seconds']}s "
+                f"{record['peak_rss_mb']}MB {record['rows_per_second']} rows/s "
+                f"correct={record['correct']}")
+            records.append(record)
+
+    report = {
+        "commit": get_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "records": records
+    }
+    write_report(report, args["report"])
+
+    if args["baseline"]:
+        with open(args["baseline"], encoding="utf8") as baseline_file:
+            regressions = compare_reports(report, json.load(baseline_file), args["tolerance"])
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+def generate_dataset(size, data_folder):
+    """
+    Generates the current and history datasets of the size once and returns their folder
+    """
+    max_current, days = SIZES[size]
+    dataset_folder = os.path.join(data_folder, size)
+    if not os.path.exists(os.path.join(dataset_folder, test_data_generator.TEST_DATA_IN2)):
+        params = test_data_generator.VolumeParams(size, max_current, days, data_folder)
+        test_data_generator.generate_current(params)
+        test_data_generator.generate_history(params)
+    return dataset_folder
+
+def run_variant(size, variant, dataset_folder):
+    """
+    Runs creator.py with the variant options in a child process and returns its wall time,
+    peak resident memory, throughput and stage timings
+    """
+    max_current, days = SIZES[size]
+    result_path = os.path.join(dataset_folder, f"result-{variant}.csv")
+    metrics_path = os.path.join(dataset_folder, f"metrics-{variant}.json")
+    command = [
+        sys.executable, CREATOR,
+        "-ds1", os.path.join(dataset_folder, test_data_generator.TEST_DATA_IN1),
+        "-ds2", os.path.join(dataset_folder, test_data_generator.TEST_DATA_IN2),
+        "-r", result_path, "-m", metrics_path
+    ] + VARIANTS[variant]
+
+    start_time = time.perf_counter()
+    peak_rss = 0
+    with subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as process:
+        # The spark JVM is a child of the driver process so the whole process tree is sampled
+        while process.poll() is None:
+            peak_rss = max(peak_rss, get_tree_rss(process.pid))
+            time.sleep(RSS_INTERVAL)
+    wall_seconds = time.perf_counter() - start_time
+
+    stages = {}
+    if os.path.exists(metrics_path):
+        with open(metrics_path, encoding="utf8") as metrics_file:
+            stages = {x["name"]: x["seconds"] for x in json.load(metrics_file)["stages"]}
+    history_rows = max_current * (days + 1)
+    return {
+        "size": size,
+        "variant": variant,
+        "current_rows": max_current,
+        "history_rows": history_rows,
+        "exit_code": process.returncode,
+        "correct": md5(result_path) == md5(
+            os.path.join(dataset_folder, test_data_generator.TEST_DATA_OUT)),
+        "wall_seconds": round(wall_seconds, 3),
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+        "rows_per_second": round(history_rows / wall_seconds),
+        "stages": stages
+    }
+
+def get_tree_rss(pid):
+    """
+    Returns the resident memory in bytes of the process and of its descendants from /proc,
+    0 where /proc is not available
+    """
+    try:
+        with open(f"/proc/{pid}/statm", encoding="utf8") as statm_file:
+            rss = int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children", encoding="utf8") as children_file:
+                rss += sum(get_tree_rss(int(x)) for x in children_file.read().split())
+        return rss
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def compare_reports(report, baseline, tolerance):
+    """
+    Returns the size and variant records whose wall time exceeds the baseline by the tolerance
+    """
+    baseline_seconds = {(x["size"], x["variant"]): x["wall_seconds"] for x in baseline["records"]}
+    regressions = []
+    for record in report["records"]:
+        previous = baseline_seconds.get((record["size"], record["variant"]))
+        if previous and record["wall_seconds"] > previous * tolerance:
+            regressions.append(f"{record['size']} {record['variant']} "
+                f"{previous}s -> {record['wall_seconds']}s ({baseline.get('commit')} -> "
+                f"{report['commit']})")
+        if not record["correct"]:
+            regressions.append(f"{record['size']} {record['variant']} result differs from "
+                "the expected result")
+    return regressions
+
+def write_report(report, report_path):
+    """
+    Writes the report as json and as csv with one column by stage
+    """
+    with open(report_path, "w", encoding="utf8") as report_file:
+        json.dump(report, report_file, indent=2)
+
+    stage_names = sorted({x for record in report["records"] for x in record["stages"]})
+    columns = ["commit", "date", "size", "variant", "current_rows", "history_rows", "exit_code",
+        "correct", "wall_seconds", "peak_rss_mb", "rows_per_second"]
+    with open(os.path.splitext(report_path)[0] + ".csv", "w", encoding="utf8") as csv_file:
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow(columns + [f"stage_{x}_seconds" for x in stage_names])
+        for record in report["records"]:
+            row = dict(record, commit=report["commit"], date=report["date"])
+            writer.writerow([row[x] for x in columns] +
+                [record["stages"].get(x, "") for x in stage_names])
+    print(f"Benchmark report written to {report_path}")
+
+def get_commit():
+    """
+    Returns the current git commit of the repository or unknown
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_ROOT,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def md5(file_path):
+    """
+    Generate MD5 for provided path, None when the path does not exist
+    """
+    if not os.path.isfile(file_path):
+        return None
+    checksum = hashlib.md5()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(61440), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+def validate_args(args):
+    """
+    Validates the input arguments against the known sizes and variants
+    """
+    sizes = args.sizes.split(",")
+    variants = args.variants.split(",")
+    unknown = [x for x in sizes if x not in SIZES] + [x for x in variants if x not in VARIANTS]
+    if unknown:
+        print(f"unknown sizes or variants {unknown}")
+        sys.exit(1)
+    if args.baseline is not None and not os.path.exists(args.baseline):
+        print("baseline is required to exist")
+        sys.exit(1)
+    return {
+        'sizes': sizes,
+        'variants': variants,
+        'data_folder': args.data_folder,
+        'report': args.report,
+        'baseline': args.baseline,
+        'tolerance': args.tolerance
+    }
+
+if __name__ == '__main__':
+    main(validate_args(parse_input()))
+    sys.exit()
@@ -0,0 +1,81 @@
+"""
+# Title : Code Assessment - Bucketed Datasets
+# Description : Datasets bucketed by Primary_key, joined and aggregated without an exchange
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+from pyspark.sql import SparkSession
+
+logger = logging.getLogger()
+
+# Bucketed dataset sidecar with the bucket count, format and schema of its table
+BUCKETING_FILE = "_bucketing.json"
+BUCKETS = 64
+
+def get_bucketing(dataset_path):
+    """
+    Returns the bucket count, format and schema of a bucketed dataset directory or None when
+    the dataset is not bucketed
+    """
+    bucketing_path = os.path.join(dataset_path, BUCKETING_FILE)
+    if not os.path.isfile(bucketing_path):
+        return None
+    with open(bucketing_path, encoding="utf8") as bucketing_file:
+        return json.load(bucketing_file)
+
+def is_co_bucketed(dataset1_path, dataset2_path):
+    """
+    Returns whether both datasets are bucketed by Primary_key into the same number of buckets
+    """
+    bucketings = [get_bucketing(x) if x is not None and os.path.isdir(x) else None
+        for x in [dataset1_path, dataset2_path]]
+    return None not in bucketings and bucketings[0]["buckets"] == bucketings[1]["buckets"]
+
+def register_bucketed(spark, dataset_path, bucketing):
+    """
+    Registers the bucketed dataset directory as an external session table carrying its
+    bucketing and returns the table name, the table is recreated to list the appended files
+    """
+    table = "bucketed_" + hashlib.md5(os.path.abspath(dataset_path).encode("utf8")).hexdigest()
+    location = os.path.abspath(dataset_path).replace("\\", "\\\\").replace("'", "\\'")
+    spark.sql(f"DROP TABLE IF EXISTS {table}")
+    spark.sql(f"CREATE TABLE {table} ({bucketing['schema']}) USING {bucketing['format']} "
+        f"CLUSTERED BY (Primary_key) SORTED BY (Primary_key) INTO {bucketing['buckets']} "
+        f"BUCKETS LOCATION '{location}'")
+    return table
+
+def write_bucketed(dataset, dataset_path, output_format="parquet", buckets=BUCKETS,
+    mode="overwrite"):
+    """
+    Writes the dataset bucketed and sorted by Primary_key with one file by bucket so that the
+    key joins and aggregations of the readers need no exchange. In append mode the new rows are
+    written as new files of the same buckets.
+    """
+    bucketing = {
+        "buckets": buckets,
+        "format": output_format,
+        "schema": ", ".join(f"`{x.name}` {x.dataType.simpleString()}"
+            for x in dataset.schema.fields)
+    }
+    if os.path.exists(dataset_path):
+        existing = get_bucketing(dataset_path) if os.path.isdir(dataset_path) else None
+        if mode != "append":
+            shutil.rmtree(dataset_path)
+        elif existing != bucketing:
+            logger.info("appended rows are required to match the bucketing of the dataset - %s "
+                "- %s", dataset_path, existing)
+            sys.exit(1)
+    table = register_bucketed(SparkSession.getActiveSession(), dataset_path, bucketing)
+    dataset.repartition(buckets, "Primary_key").sortWithinPartitions("Primary_key")\
+    .write.insertInto(table)
+    with open(os.path.join(dataset_path, BUCKETING_FILE), "w",
+        encoding="utf8") as bucketing_file:
+        json.dump(bucketing, bucketing_file)
@@ -0,0 +1,145 @@
+"""
+# Title : Code Assessment - Dataset Converter
+# Description : This is utility to convert the csv datasets to columnar datasets
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import textwrap
+import sys
+import os
+import argparse
+import creator
+import numpy_engine
+import datasets
+import bucketing
+from creator import logger
+
+def parse_input():
+    """
+    Parse script arguments
+    """
+    parser =  argparse.ArgumentParser(
+        prog=sys.argv[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+example:
+    # Convert a history csv file into a parquet dataset partitioned by Cob_date
+    python3 ./converter.py -i dataset2.csv -o dataset2.parquet
+
+    # Convert a history csv file into a bitmask encoded parquet dataset partitioned by Cob_day
+    python3 ./converter.py -i dataset2.csv -o dataset2.parquet --encoding bitmask
+
+    # Convert a current csv file into an orc dataset
+    python3 ./converter.py -i dataset1.csv -o dataset1.orc --dataset current --format orc
+
+    # Convert the history and current csv files into parquet datasets bucketed by Primary_key,
+    # then append a daily history slice into the same buckets
+    python3 ./converter.py -i dataset2.csv -o dataset2.parquet --layout bucketed --buckets 64
+    python3 ./converter.py -i dataset1.csv -o dataset1.parquet --layout bucketed --buckets 64 \
+        --dataset current
+    python3 ./converter.py -i daily_slice.csv -o dataset2.parquet --layout bucketed --buckets 64 \
+        --mode append
+    ''')
+    )
+
+    parser.add_argument("-i","--input_path", help="Dataset input csv file, directory or glob "
+        "pattern path, gzip and bz2 files are decompressed", required=True)
+    parser.add_argument("-o","--output_path", help="Dataset output directory path",
+        required=True)
+    parser.add_argument("-d","--dataset", help="Dataset type, the history dataset is partitioned "
+        "by Cob_date", choices = ["history", "current"], default="history", required=False)
+    parser.add_argument("-a","--attributes", help="Comma separated Yes/No attribute columns "
+        "between Primary_key and the date column", default=",".join(creator.ATTRIBUTES),
+        required=False)
+    parser.add_argument("-en","--encoding", help="History attribute encoding, bitmask packs the "
+        "Yes/No attributes of a row in one integer and stores the Cob_date as a day number",
+        choices = ["strings", "bitmask"], default="strings", required=False)
+    parser.add_argument("-f","--format", help="Dataset output format",
+        choices = ["parquet", "orc"], default="parquet", required=False)
+    parser.add_argument("-l","--layout", help="Dataset output layout, partitioned writes the "
+        "history partitioned by Cob_date and bucketed writes the dataset bucketed and sorted by "
+        "Primary_key so that creator.py joins and aggregates it without an exchange",
+        choices = ["partitioned", "bucketed"], default="partitioned", required=False)
+    parser.add_argument("-b","--buckets", help="Number of Primary_key buckets of the bucketed "
+        "layout, datasets joined together are required to have the same number",
+        type=int, default=bucketing.BUCKETS, required=False)
+    parser.add_argument("-m","--mode", help="Output mode, append adds the rows to an existing "
+        "dataset of the same layout, bucketing and encoding",
+        choices = ["overwrite", "append"], default="overwrite", required=False)
+    args = parser.parse_args()
+    return args
+
+def convert(args):
+    """
+    Rewrites the csv dataset into a columnar dataset, the history dataset is written with one
+    partition directory by Cob_date so that date filters prune whole partitions, or by Cob_day
+    when its attributes are bitmask encoded. The bucketed layout distributes either dataset by
+    Primary_key instead.
+    """
+    spark = creator.get_spark_session("DataSetConvert",
+        creator.get_spark_config([args["input_path"]]))
+
+    date_column = "Cob_date" if args["dataset"] == "history" else "Current_date"
+    attributes = args.get("attributes", creator.ATTRIBUTES)
+    encoded = args["dataset"] == "history" and args.get("encoding", "strings") == "bitmask"
+    mode = args.get("mode", "overwrite")
+    if mode == "append" and os.path.isdir(args["output_path"]) and \
+        datasets.get_encoding(args["output_path"]) != (attributes if encoded else None):
+        logger.info("appended rows are required to match the encoding of the dataset - %s",
+            args["output_path"])
+        sys.exit(1)
+    if mode == "append" and args.get("layout", "partitioned") == "partitioned" and \
+        os.path.isdir(args["output_path"]) and bucketing.get_bucketing(args["output_path"]):
+        logger.info("appended rows are required to match the layout of the dataset - %s",
+            args["output_path"])
+        sys.exit(1)
+    dataset = datasets.get_dataset(args["input_path"], datasets.get_schema(date_column, attributes),
+        spark)
+    if encoded:
+        dataset = datasets.encode_attributes(dataset, attributes, date_column)
+        date_column = datasets.DAY_COLUMN
+    if args.get("layout", "partitioned") == "bucketed":
+        bucketing.write_bucketed(dataset, args["output_path"], args["format"],
+            args.get("buckets", bucketing.BUCKETS), mode)
+    else:
+        writer = dataset.write.mode(mode).format(args["format"])
+        if args["dataset"] == "history":
+            writer = writer.partitionBy(date_column)
+        writer.save(args["output_path"])
+    if encoded:
+        datasets.write_encoding(args["output_path"], attributes)
+    logger.info("dataset converted - %s - %s", args["input_path"], args["output_path"])
+
+def validate_args(args):
+    """
+    Validates the input arguments to check file paths exists
+    """
+    if args.input_path is None or not numpy_engine.get_input_files(args.input_path):
+        logger.info("input_path is required to match existing files")
+        sys.exit(1)
+    if args.buckets < 1:
+        logger.info("buckets is required to be at least 1")
+        sys.exit(1)
+    attributes = [x.strip() for x in args.attributes.split(",")]
+    if args.dataset == "history" and args.encoding == "bitmask" and \
+        len(attributes) > datasets.MAX_ENCODED_ATTRIBUTES:
+        logger.info("bitmask encoding supports at most %s attributes",
+            datasets.MAX_ENCODED_ATTRIBUTES)
+        sys.exit(1)
+    return {
+            'input_path': args.input_path,
+            'output_path': args.output_path,
+            'dataset': args.dataset,
+            'attributes': attributes,
+            'encoding': args.encoding,
+            'format': args.format,
+            'layout': args.layout,
+            'buckets': args.buckets,
+            'mode': args.mode
+        }
+
+if __name__ == '__main__':
+    convert(validate_args(parse_input()))
+    sys.exit()
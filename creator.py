@@ -11,12 +11,28 @@ import sys
 import logging
 import os
 import argparse
-import tempfile
 import shutil
+import json
+import io
+from datetime import date, timedelta
+from contextlib import redirect_stdout
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import when, datediff, date_format, max as spark_max
-from pyspark.sql.functions import col
-from pyspark.sql.types import StructType, StringType, IntegerType, DateType
+from pyspark.sql.functions import when, datediff, max as spark_max
+from pyspark.sql.functions import col, greatest, lit, coalesce, min as spark_min
+from pyspark.sql.functions import sum as spark_sum
+from pyspark.sql.functions import broadcast, expr, date_sub
+import numpy_engine
+import result_cache
+from metrics import RunMetrics
+from datasets import FLAGS_COLUMN, DAY_COLUMN, MAX_ENCODED_ATTRIBUTES, days_since_column
+from datasets import first_yes_column, filter_history_from, get_dataset
+from datasets import get_schema, get_result_schema, get_history, get_encoding, get_input_format
+from datasets import decode_attributes, export_results, BATCH_ROWS, get_arrow_table
+from datasets import iter_arrow_batches
+from quality import QUALITY_THRESHOLD, QualityError, check_quality, get_quarantine_path
+from quality import validate_quality
+from backfill import get_backfill, export_backfill, validate_backfill
+from bucketing import is_co_bucketed
 
 # Logging configuration
 log_formatter = logging.Formatter('[%(asctime)s] %(levelname)s @ line %(lineno)d: %(message)s')
@@ -27,12 +43,52 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(handler)
 
-def parse_input():
+ATTRIBUTES = ["Attribute_a", "Attribute_B", "Attribute_C"]
+# Spark settings of the execution profiles, auto picks small below SMALL_INPUT_BYTES of input
+# files. The large profile starts from one shuffle partition by LARGE_PARTITION_BYTES of input
+# which adaptive execution coalesces, and splits the skewed join partitions.
+SMALL_INPUT_BYTES = 256 * 1024 * 1024
+# Estimated decompressed bytes by byte of a gzip or bz2 input file, the Yes/No csv datasets
+# compress about 10 times with gzip and more with bz2
+COMPRESSION_RATIO = 10
+LARGE_PARTITION_BYTES = 32 * 1024 * 1024
+# Parsed datasets kept by the dataset cache of the job server
+DATASET_CACHE_ENTRIES = 8
+# Options of the export, cache and report steps of creator.main that compute does not run
+MAIN_OPTIONS = ["result_path", "show", "output_format", "output_layout", "backfill_to",
+    "quarantine_path", "quality_threshold", "cache_dir", "cache_mb", "cache_hash",
+    "metrics_path", "profile_path"]
+# Command line options of the creator.main arguments named differently, the job server maps its
+# json keys through them
+ARGUMENT_OPTIONS = {"previous_result_path": "previous_result",
+    "spark_config_path": "spark_config", "metrics_path": "metrics", "profile_path": "profile"}
+SPARK_PROFILES = {
+    "small": {
+        "spark.sql.shuffle.partitions": "4",
+        "spark.default.parallelism": "4",
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.autoBroadcastJoinThreshold": str(64 * 1024 * 1024)
+    },
+    "large": {
+        "spark.sql.shuffle.partitions": "200",
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.adaptive.coalescePartitions.enabled": "true",
+        "spark.sql.adaptive.advisoryPartitionSizeInBytes": str(64 * 1024 * 1024),
+        "spark.sql.adaptive.skewJoin.enabled": "true",
+        "spark.sql.autoBroadcastJoinThreshold": str(256 * 1024 * 1024),
+        "spark.sql.files.maxPartitionBytes": str(128 * 1024 * 1024),
+        "spark.driver.memory": "4g",
+        "spark.memory.fraction": "0.8"
+    }
+}
+
+def parse_input(argv=None):
     """
-    Parse script arguments
+    Parse script arguments, from the command line unless argv is provided
     """
     parser =  argparse.ArgumentParser(
         prog=sys.argv[0],
+        fromfile_prefix_chars="@",
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description=textwrap.dedent('''\
 example:
@@ -43,6 +99,58 @@ example:
     # and show the resulting dataset truncated
     python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r results.csv --show Yes
 
+    # Incremental daily run: fold only the new Cob_date slice into the first Yes state
+    # snapshot kept in state_dir and produce the results from the updated snapshot
+    python3 ./creator.py -ds1 dataset1.csv -ds2 daily_slice.csv -r results.csv -st state_dir
+
+    # Process a different set of Yes/No attribute columns
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r results.csv -a Flag_1,Flag_2
+
+    # Read the arguments from a configuration file with one argument per line
+    python3 ./creator.py @run.args
+
+    # Use the legacy plan joining every history row before grouping, for benchmarking
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r results.csv --plan legacy
+
+    # Run on a single node with the numpy engine without starting a spark session
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r results.csv --engine numpy
+
+    # Look the keys up in a memory mapped history index (see history_index.py)
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.index -r results.csv --engine numpy
+
+    # Read a directory or glob pattern of daily gzip or bz2 history files in parallel, with the
+    # Cob_date of each row taken from the yyyy-MM-dd or yyyyMMdd date of its file name
+    python3 ./creator.py -ds1 dataset1.csv -ds2 "history/*.csv.gz" -r results.csv --file_date Yes
+
+    # Process the Primary_key shard 0 of 4 on one machine, the shard results of the machines
+    # are merged into one result in key order (see merger.py)
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r results_0.csv --shard 0/4
+
+    # Pass a history dataset converted to parquet partitioned by Cob_date (see converter.py)
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.parquet -r results.csv
+
+    # Quarantine the invalid rows to results_quarantine.csv and stop above 5% of invalid rows
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r results.csv -q Yes -qt 0.05
+
+    # Only export the rows that changed from the previous result with an Operation column
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r changes.csv -pr results.csv
+
+    # Reuse the cached result of the same inputs and options instead of computing it again
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r results.csv -cd ~/.cache/creator
+
+    # Force the large spark execution profile and override some of its settings
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r results.csv \
+        --spark_profile large --spark_config spark.json
+
+    # Backfill the results as of every date of a range in one scan of the history, written
+    # under results_dir with one As_of_date=YYYY-MM-DD partition directory by date
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r results_dir \
+        --backfill_from 2021-01-01 --backfill_to 2021-03-31
+
+    # Only consider the history of the last 30 days before the Current_date, the days since are
+    # measured from the first Yes in that window and the older Cob_date partitions are not read
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.parquet -r results.csv -lb 30
+
     # dataset1 Current dataset file format
     # delimiter: ','
     # headers: Primary_key,Attribute_a,Attribute_B,Attribute_C,Current_date
@@ -69,147 +177,782 @@ example:
     ''')
     )
 
-    parser.add_argument("-ds1","--dataset1_path", help = "Current Dataset input csv file path",
-        required=True)
-    parser.add_argument("-ds2","--dataset2_path", help = "History Dataset input csv file path",
-        required=True)
+    parser.add_argument("-ds1","--dataset1_path", help = "Current Dataset input csv file, "
+        "directory or glob pattern path, gzip and bz2 files are decompressed", required=True)
+    parser.add_argument("-ds2","--dataset2_path", help = "History Dataset input csv file, "
+        "directory or glob pattern path, gzip and bz2 files are decompressed", required=True)
     parser.add_argument("-r","--result_path", help="Result Dataset export csv file path",
         required=True)
+    parser.add_argument("-st","--state_path", help="First Yes state snapshot directory for the "
+        "incremental mode, created on the first run and updated with the new Cob_date rows of "
+        "dataset2 on each following run", default=None, required=False)
+    parser.add_argument("-a","--attributes", help="Comma separated Yes/No attribute columns "
+        "between Primary_key and the date column of both datasets",
+        default=",".join(ATTRIBUTES), required=False)
+    parser.add_argument("-e","--engine", help="Processing engine, numpy runs on a single node "
+        "without starting a spark session and only supports csv datasets",
+        choices = ["spark", "numpy"], default="spark", required=False)
+    parser.add_argument("-p","--plan", help="Execution plan, aggregate reduces the history to "
+        "the first Yes dates by key before a broadcast join and legacy joins every history row "
+        "before grouping", choices = ["aggregate", "legacy"], default="aggregate", required=False)
+    parser.add_argument("-f","--input_format", help="Format of both datasets, auto detects "
+        "parquet and orc from the file extension and defaults to csv",
+        choices = ["auto", "csv", "parquet", "orc"], default="auto", required=False)
+    parser.add_argument("-of","--output_format", help="Format of the result export, csv writes a "
+        "single file and parquet or orc write a dataset directory",
+        choices = ["csv", "parquet", "orc"], default="csv", required=False)
+    parser.add_argument("-ol","--output_layout", help="Layout of the csv result export, file "
+        "joins the part files written in parallel into result_path and directory keeps the "
+        "multi-part directory", choices = ["file", "directory"], default="file", required=False)
+    parser.add_argument("-so","--sort", help="Sort the results by Primary_key, without the sort "
+        "the rows are exported in any order (see verifier.py to compare such results)",
+        choices = ["Yes", "No"], default="Yes", required=False)
+    parser.add_argument("-fd","--file_date", help="Take the Cob_date of the history csv rows "
+        "from the yyyy-MM-dd or yyyyMMdd date of their file name instead of parsing the column",
+        choices = ["No", "Yes"], default="No", required=False)
+    parser.add_argument("-sh","--shard", help="Only process the Primary_key shard i/N of both "
+        "datasets, the keys whose value modulo N is i, and write the sorted shard result",
+        default=None, required=False)
+    parser.add_argument("-sn","--since", help="Truncates the history to the Cob_dates from "
+        "YYYY-MM-DD, older history rows are skipped so the days since are measured from the "
+        "first Yes from this date and a key Yes only before it reports 0. The current keys with "
+        "no history from this date are not reported and their count is logged",
+        default=None, required=False)
+    parser.add_argument("-lb","--lookback_days", help="Truncates the history to this number of "
+        "days before the Current_date of each key, older history rows are skipped so the days "
+        "since are measured from the first Yes in the window and a key Yes only before it reports "
+        "0. The current keys with no history in the window are not reported and their count is "
+        "logged. A key with several Current_dates is windowed from the earliest one", type=int,
+        default=None, required=False)
+    parser.add_argument("-bf","--backfill_from", help="First as of date YYYY-MM-DD of a backfill, "
+        "the results are computed as of every date of the range in one scan of the history and "
+        "written to result_path partitioned by As_of_date", default=None, required=False)
+    parser.add_argument("-bt","--backfill_to", help="Last as of date YYYY-MM-DD of a backfill",
+        default=None, required=False)
+    parser.add_argument("-pr","--previous_result", help="Previous result path, only the rows "
+        "that changed from it are exported with an Operation column of insert, update or delete",
+        default=None, required=False)
+    parser.add_argument("-q","--quality", help="Check the csv datasets in the same scan as the "
+        "aggregation, invalid rows are quarantined and excluded from the results",
+        choices = ["No", "Yes"], default="No", required=False)
+    parser.add_argument("-qp","--quarantine_path", help="Quarantine csv file path of the rows "
+        "failing the data quality checks, next to result_path by default", default=None,
+        required=False)
+    parser.add_argument("-qt","--quality_threshold", help="Share of quarantined rows above which "
+        "the run stops without results", type=float, default=QUALITY_THRESHOLD, required=False)
+    parser.add_argument("-sp","--spark_profile", help="Spark execution profile, auto picks small "
+        "or large from the input file sizes", choices = ["auto", "small", "large"],
+        default="auto", required=False)
+    parser.add_argument("-sc","--spark_config", help="Json file of spark settings applied over "
+        "the execution profile", default=None, required=False)
+    parser.add_argument("-cd","--cache_dir", help="Result cache directory, a run with the same "
+        "input files and options copies the cached result to result_path instead of computing "
+        "it. The results are only cached with a cache directory", default=None, required=False)
+    parser.add_argument("-cm","--cache_mb", help="Result cache size in megabytes beyond which "
+        "the least recently used results are evicted, larger results are not cached", type=int,
+        default=result_cache.CACHE_MB, required=False)
+    parser.add_argument("-ch","--cache_hash", help="Input file content hashed in the cache key "
+        "along with the file sizes and modification times, sample hashes the first and last "
+        "megabyte", choices = ["none", "sample", "full"], default="sample", required=False)
+    parser.add_argument("-m","--metrics", help="Per stage metrics json report file path with "
+        "the wall times, row counts, shuffle and spill bytes of each stage and the physical plan",
+        default=None, required=False)
+    parser.add_argument("-pf","--profile", help="cProfile stats file path of the driver python "
+        "code, the top functions are also added to the metrics report", default=None,
+        required=False)
     parser.add_argument("-s","--show", help="Print final dataset to screen with option to truncate",choices = ["No", "Yes", "Full"],
         default="No", required=False)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     return args
 
-def main(args):
+def main(args, dataset_cache=None):
     """
     Process the provided files into current and history dataset
     Determines the date difference from the current date by Primary_key values in dataset1
     to the historical values in dataset2 and then groups these based on Primary_key to return the
     last time each attribute was true or Yes with the days since attribute results.
+    A dataset_cache dictionary kept between calls reuses the parsed spark datasets whose files
+    did not change.
+    """
+    metrics = RunMetrics(dict(args))
+    cache_key = None
+    if args.get("cache_dir"):
+        cache_key = result_cache.get_key(args)
+    # The quarantine file of the quality checks is cached along with the result
+    output_paths = {"result": args["result_path"]}
+    if args.get("quality", "No") == "Yes":
+        output_paths["quarantine"] = get_quarantine_path(args)
+    if cache_key and result_cache.restore(args["cache_dir"], cache_key, output_paths):
+        metrics.report["cache"] = "hit"
+    else:
+        with metrics.profile(args.get("profile_path")):
+            if args.get("engine", "spark") == "numpy":
+                numpy_engine.main(args, metrics)
+            else:
+                run_spark(args, metrics, dataset_cache)
+        if cache_key:
+            result_cache.store(args["cache_dir"], cache_key, output_paths,
+                args.get("cache_mb", result_cache.CACHE_MB))
+            metrics.report["cache"] = "miss"
+    if args.get("metrics_path"):
+        metrics.write(args["metrics_path"])
+
+def compute(dataset1, dataset2, output="dataframe", batch_rows=BATCH_ROWS, **options):
+    """
+    Returns the results of the current and history datasets without exporting them, the datasets
+    are spark dataframes with the csv columns or dataset paths. The options are the creator.main
+    argument keys. The output is the lazy spark dataframe, a pyarrow table collected from it or a
+    lazy iterator of pyarrow record batches of batch_rows rows, one partition at a time.
+    """
+    if output not in ["dataframe", "arrow", "batches"]:
+        raise ValueError(f"output is required to be dataframe, arrow or batches - {output}")
+    if options.get("engine", "spark") != "spark":
+        raise ValueError(f"engine is required to be spark - {options['engine']}")
+    if options.get("backfill_from") or options.get("quality", "No") == "Yes":
+        raise ValueError("backfill and quality checks are only supported by creator.main")
+    cli_options = [x for x in MAIN_OPTIONS if options.get(x) is not None]
+    if cli_options:
+        raise ValueError(f"options are only supported by creator.main - {', '.join(cli_options)}")
+    args = dict(options)
+    datasets = {"dataset1_path": dataset1, "dataset2_path": dataset2}
+    args.update({x: y if isinstance(y, str) else None for x, y in datasets.items()})
+    results, _ = get_spark_results(args, RunMetrics(dict(args)), None,
+        [None if isinstance(x, str) else x for x in datasets.values()])
+    if output == "dataframe":
+        return results
+    if output == "arrow":
+        return get_arrow_table(results)
+    return iter_arrow_batches(results, batch_rows)
+
+def run_spark(args, metrics, dataset_cache=None):
     """
+    Runs the process with the spark engine from the same results as compute, the plan stage only
+    builds the lazy plan and the history is read and aggregated during the export stage
+    """
+    results, persisted_datasets = get_spark_results(args, metrics, dataset_cache)
+    if args.get("backfill_from"):
+        with metrics.stage("backfill"):
+            export_backfill(results, args["result_path"], args.get("output_format", "csv"),
+                args.get("sort", "Yes") == "Yes")
+        return
     try:
-        spark = SparkSession.builder.appName("DataSetCompare").getOrCreate()
+        # shows the final result set on the screen based on selected option
+        if args["show"] != "No":
+            trunc =  args["show"] == "Yes"
+            results.show(truncate=trunc)
+
+        with metrics.stage("export"):
+            export_results(results, args["result_path"], args.get("output_format", "csv"),
+                args.get("output_layout", "file"))
+    finally:
+        for dataset in persisted_datasets:
+            dataset.unpersist()
+
+def get_spark_results(args, metrics, dataset_cache=None, dataframes=(None, None)):
+    """
+    Returns the lazy results of the spark engine, or the backfill results, along with the
+    datasets persisted for them. The datasets are read from their paths unless provided as
+    dataframes, whose session keeps its own settings
+    """
+    with metrics.stage("session"):
+        spark_config = {}
+        if all(x is None for x in dataframes):
+            spark_config = get_spark_config([args["dataset1_path"], args["dataset2_path"]],
+                args.get("spark_profile", "auto"), args.get("spark_config_path"))
+            metrics.report["spark_config"] = spark_config
+        spark = get_spark_session("DataSetCompare", spark_config)
+    if args.get("metrics_path"):
+        metrics.attach_spark(spark.sparkContext)
+    dataset1, dataset2 = get_datasets(args, spark, dataset_cache, *dataframes)
+    if args.get("backfill_from"):
+        return get_backfill(dataset1, dataset2, args.get("attributes", ATTRIBUTES),
+            date.fromisoformat(args["backfill_from"]), date.fromisoformat(args["backfill_to"])), []
+    return get_results(dataset1, dataset2, args, spark, metrics)
+
+def get_datasets(args, spark, dataset_cache=None, dataset1=None, dataset2=None):
+    """
+    Returns the current and history datasets loaded from their paths unless provided as
+    dataframes, restricted to the shard of the run
+    """
+    # Imports the data sets into dataframes with their schema
+    attributes = args.get("attributes", ATTRIBUTES)
+    input_format = args.get("input_format", "auto")
+    if dataset1 is None:
+        dataset1 = get_cached_dataset(dataset_cache, args["dataset1_path"],
+            (attributes, input_format), lambda: get_dataset(args["dataset1_path"],
+                get_schema("Current_date", attributes), spark, input_format))
+    file_date = args.get("file_date", "No")
+    if dataset2 is None:
+        dataset2 = get_cached_dataset(dataset_cache, args["dataset2_path"],
+            (attributes, input_format, file_date),
+            lambda: get_history(args["dataset2_path"], attributes, spark, input_format,
+                file_date))
+    if args.get("shard"):
+        dataset1 = filter_shard(dataset1, args["shard"])
+        dataset2 = filter_shard(dataset2, args["shard"])
+    return dataset1, dataset2
+
+def get_results(dataset1, dataset2, args, spark, metrics):
+    """
+    Returns the lazy results dataframe of the current and history datasets along with the
+    datasets persisted for it, to unpersist once the results are exported
+    """
+    attributes = args.get("attributes", ATTRIBUTES)
+    if args.get("since") or args.get("lookback_days") is not None:
+        dataset2 = get_history_window(dataset1, dataset2, args.get("since"),
+            args.get("lookback_days"))
+
+    # The aggregate plan reduces the history to one row per key before the join, the legacy plan
+    # joins every history row to the current dataset and groups afterwards
+    persisted_datasets = []
+    if args.get("quality", "No") == "Yes":
+        with metrics.stage("quality"):
+            dataset1, first_yes, persisted_datasets = check_quality(args, attributes, spark)
+    elif args.get("state_path"):
+        with metrics.stage("state"):
+            first_yes = update_state(dataset2, args["state_path"], spark, attributes)
+    elif args.get("plan", "aggregate") == "aggregate":
+        first_yes = get_first_yes(dataset2, attributes)
+    else:
+        first_yes = None
+
+    with metrics.stage("plan"):
+        if first_yes is not None:
+            first_yes = log_dropped_keys(dataset1, first_yes, args, persisted_datasets)
+            results = get_first_yes_days_since(dataset1, first_yes, attributes,
+                not is_co_bucketed(args["dataset1_path"], args["dataset2_path"]))
+        else:
+            dataset_grouped = get_days_since(dataset1, decode_attributes(dataset2, attributes),
+                attributes)
+            dataset_grouped = log_dropped_keys(dataset1, dataset_grouped, args,
+                persisted_datasets)
+
+            # Combines final result set into dataframe
+            results=dataset1.alias("dataset1").join(dataset_grouped, dataset1.Primary_key == \
+                dataset_grouped.Primary_key) \
+            .select(["dataset1.Primary_key"] + attributes + ["Current_date"] + \
+                [days_since_column(x) for x in attributes])
+
+        if args.get("previous_result_path"):
+            previous = get_dataset(args["previous_result_path"], get_result_schema(attributes),
+                spark, get_input_format(args["previous_result_path"]))
+            if args.get("shard"):
+                previous = filter_shard(previous, args["shard"])
+            results = get_delta(results, previous, attributes)
+
+        # The global sort costs a full shuffle and is skipped when the order is not needed
+        if args.get("sort", "Yes") == "Yes":
+            results = results.orderBy("Primary_key")
+        if args.get("metrics_path"):
+            metrics.report["physical_plan"] = explain_plan(results)
+    return results, persisted_datasets
+
+def get_input_bytes(paths):
+    """
+    Returns the total size of the files of the provided file, directory and glob pattern paths,
+    compressed files count for their estimated decompressed size
+    """
+    total_bytes = 0
+    for path in paths:
+        for file_path in numpy_engine.get_input_files(path):
+            file_bytes = os.path.getsize(file_path)
+            if os.path.splitext(file_path)[1].lower() in numpy_engine.COMPRESSED_OPENERS:
+                file_bytes *= COMPRESSION_RATIO
+            total_bytes += file_bytes
+    return total_bytes
+
+def get_spark_config(input_paths, profile="auto", config_path=None):
+    """
+    Returns the spark settings of the execution profile, picked from the input file sizes in auto
+    mode, with the settings of the json config file applied over them
+    """
+    input_bytes = get_input_bytes(input_paths)
+    if profile == "auto":
+        profile = "small" if input_bytes < SMALL_INPUT_BYTES else "large"
+    spark_config = dict(SPARK_PROFILES[profile])
+    if profile == "large":
+        spark_config["spark.sql.shuffle.partitions"] = str(max(
+            int(spark_config["spark.sql.shuffle.partitions"]),
+            input_bytes // LARGE_PARTITION_BYTES))
+    if config_path:
+        with open(config_path, encoding="utf8") as config_file:
+            spark_config.update({x: str(y) for x, y in json.load(config_file).items()})
+    logger.info("spark profile %s for %s input bytes", profile, input_bytes)
+    return spark_config
+
+def get_spark_session(app_name, spark_config):
+    """
+    Returns the spark session with the provided settings, the runtime settings are applied to an
+    already running session and the driver settings only to a new one
+    """
+    try:
+        builder = SparkSession.builder.appName(app_name)
+        for key, value in spark_config.items():
+            builder = builder.config(key, value)
+        return builder.getOrCreate()
     except Exception as err: # pylint: disable=broad-except
         logger.exception("spark session failure - %s", err)
         sys.exit()
-    # Setup schemas for data set import and imports sets into dataframes
-    dataset1_schema = StructType()
-    dataset1_schema.add('Primary_key', IntegerType(), True)
-    dataset1_schema.add('Attribute_a', StringType(), True)
-    dataset1_schema.add('Attribute_B', StringType(), True)
-    dataset1_schema.add('Attribute_C', StringType(), True)
-    dataset1_schema.add('Current_date', DateType(), True)
-
-    dataset2_schema = StructType()
-    dataset2_schema.add('Primary_key', IntegerType(), True)
-    dataset2_schema.add('Attribute_a', StringType(), True)
-    dataset2_schema.add('Attribute_B', StringType(), True)
-    dataset2_schema.add('Attribute_C', StringType(), True)
-    dataset2_schema.add('Cob_date', DateType(), True)
-
-    dataset1 = get_dataset(args["dataset1_path"], dataset1_schema, spark)
-    dataset2 = get_dataset(args["dataset2_path"], dataset2_schema, spark)
 
+def explain_plan(dataset):
+    """
+    Returns the formatted physical plan of the dataset as printed by explain
+    """
+    plan = io.StringIO()
+    with redirect_stdout(plan):
+        dataset.explain(mode="formatted")
+    return plan.getvalue()
+
+def get_days_since(dataset1, dataset2, attributes):
+    """
+    Returns the days since each attribute was first Yes by Primary_key from the full join
+    of the current dataset to the history dataset.
+    Keys with no Yes yet or a first Yes after the Current_date report 0 like the aggregate plan
+    """
     # Join the current dataset to the history dataset
     # Set columns with the date difference for the Current_date to Cob_date
     # for attribute with a Yes and equal dates for No
-    # Group by the key and take the max date diff result for each key and attribute
+    # Group by the key and take the max date diff result for each key and attribute, floored
+    # at 0 for the keys only Yes after the Current_date
+    # All the attribute columns are set in a single projection and a single aggregation
 
-    dataset_grouped = (
+    return (
         dataset1
         .join(dataset2, dataset1.Primary_key==dataset2.Primary_key, how='inner')
-        .withColumn(
-            "a1",
-            datediff(
-                dataset1.Current_date,
-                when(dataset2.Attribute_a=="Yes",
-                dataset2.Cob_date).otherwise(dataset1.Current_date))
+        .select(
+            [dataset1.Primary_key] + [
+                datediff(
+                    dataset1.Current_date,
+                    when(dataset2[attribute]=="Yes",
+                    dataset2.Cob_date).otherwise(dataset1.Current_date)
+                ).alias(days_since_column(attribute))
+                for attribute in attributes
+            ]
         )
-        .withColumn(
-            "b1",
-            datediff(
-                dataset1.Current_date,
-                when(dataset2.Attribute_B=="Yes",
-                dataset2.Cob_date).otherwise(dataset1.Current_date))
+        .groupBy("Primary_key")
+        .agg(*[
+            greatest(spark_max(col(days_since_column(attribute))), lit(0)).alias(
+                days_since_column(attribute))
+            for attribute in attributes
+        ])
+        .orderBy("Primary_key")
+    )
+
+def get_first_yes(dataset2, attributes, watermark=None):
+    """
+    Reduces the history dataset to one row per Primary_key with the earliest Cob_date each
+    attribute was Yes and the latest Cob_date seen for the key.
+    With a watermark date only the rows dated after it are reduced, the rows dated at or before
+    it are counted by key in a Late_rows column of the same aggregation
+    """
+    if FLAGS_COLUMN in dataset2.columns:
+        # Bit tests and day number minimums, converted back to dates once per key
+        history_date = col(DAY_COLUMN)
+        yes_flags = [col(FLAGS_COLUMN).bitwiseAND(1 << x) != 0 for x in range(len(attributes))]
+        if watermark is not None:
+            watermark = expr(f"unix_date(DATE'{watermark.isoformat()}')")
+    else:
+        history_date = col("Cob_date")
+        yes_flags = [col(x)=="Yes" for x in attributes]
+        if watermark is not None:
+            watermark = lit(watermark)
+    new_row = lit(True) if watermark is None else history_date > watermark
+    late_rows = [] if watermark is None else [
+        spark_sum(when(~new_row, 1).otherwise(0)).alias("Late_rows")]
+    first_yes = (
+        dataset2
+        .groupBy("Primary_key")
+        .agg(*[
+            spark_min(when(new_row & yes, history_date)).alias(first_yes_column(attribute))
+            for attribute, yes in zip(attributes, yes_flags)
+        ], spark_max(when(new_row, history_date)).alias("Last_cob_date"), *late_rows)
+    )
+    if FLAGS_COLUMN in dataset2.columns:
+        first_yes = first_yes.select(
+            [col("Primary_key")] + [
+                expr(f"date_from_unix_date({x})").alias(x)
+                for x in [first_yes_column(a) for a in attributes] + ["Last_cob_date"]
+            ] + [col(x) for x in first_yes.columns if x == "Late_rows"]
         )
-        .withColumn(
-            "c1",
-            datediff(
-                dataset1.Current_date,
-                when(dataset2.Attribute_C=="Yes",
-                dataset2.Cob_date).otherwise(dataset1.Current_date))
+    return first_yes
+
+def update_state(dataset2, state_path, spark, attributes):
+    """
+    Folds the history rows newer than the snapshot watermark into the first Yes state
+    snapshot at state_path and returns the updated snapshot.
+    The earliest Yes date of a key can never change once known so only the new Cob_date
+    rows need to be read, dataset2 can be the daily slice instead of the full history.
+    The history dates are assumed to only move forward, rows dated at or before the watermark
+    that arrive late are skipped and their count, taken in the same aggregation as the new rows,
+    is logged.
+    """
+    cached_first_yes = None
+    if os.path.exists(state_path):
+        state = spark.read.parquet(state_path)
+        # The snapshot is folded by column name, its first Yes dates are required to be those of
+        # the attributes of the run
+        columns = ["Primary_key"] + [first_yes_column(x) for x in attributes] + ["Last_cob_date"]
+        if sorted(state.columns) != sorted(columns):
+            logger.info("state snapshot columns %s do not match the attributes %s - %s",
+                state.columns, attributes, state_path)
+            sys.exit(1)
+        watermark = state.agg(spark_max(col("Last_cob_date"))).first()[0]
+        logger.info("state snapshot loaded - %s - watermark %s", state_path, watermark)
+        new_first_yes = get_first_yes(dataset2, attributes, watermark)
+        if watermark is not None:
+            # The new rows are reduced once, the late rows count and the snapshot write both
+            # read the cached reduction
+            cached_first_yes = new_first_yes.cache()
+            late_rows = cached_first_yes.agg(spark_sum(col("Late_rows"))).first()[0]
+            if late_rows:
+                logger.info("%s history rows dated at or before the watermark %s are skipped, "
+                    "the state snapshot is required to be rebuilt to fold them - %s", late_rows,
+                    watermark, state_path)
+            new_first_yes = cached_first_yes.filter(col("Last_cob_date").isNotNull()).drop(
+                "Late_rows")
+        state = (
+            state
+            .unionByName(new_first_yes)
+            .groupBy("Primary_key")
+            .agg(*[
+                spark_min(col(first_yes_column(attribute))).alias(first_yes_column(attribute))
+                for attribute in attributes
+            ], spark_max(col("Last_cob_date")).alias("Last_cob_date"))
         )
-        .groupBy(dataset1.Primary_key)
-        .agg(
-            spark_max(col("a1")),
-            spark_max(col("b1")),
-            spark_max(col("c1"))
+    else:
+        logger.info("state snapshot not found, building it from the history - %s", state_path)
+        state = get_first_yes(dataset2, attributes)
+
+    # The new snapshot is fully written before the previous one is replaced as it is still
+    # being read by the plan above
+    new_state_path = state_path.rstrip(os.sep) + ".new"
+    state.write.mode("overwrite").parquet(new_state_path)
+    if cached_first_yes is not None:
+        cached_first_yes.unpersist()
+    if os.path.exists(state_path):
+        shutil.rmtree(state_path)
+    os.rename(new_state_path, state_path)
+    return spark.read.parquet(state_path)
+
+def filter_shard(dataset, shard):
+    """
+    Returns the rows of the dataset in the [index, shards] shard, the Primary_key values whose
+    positive modulo shards is index, applied as an early filter before any exchange
+    """
+    index, shards = shard
+    return dataset.filter(expr(f"pmod(Primary_key, {shards})") == index)
+
+def get_history_window(dataset1, dataset2, since=None, lookback_days=None):
+    """
+    Truncates the history to the rows from the since date and from lookback_days before the
+    Current_date of each key, so the days since are measured from the first Yes in the window and
+    a key Yes only before the window reports 0 like a key never Yes. The first Yes before the
+    window is not capped as finding it would read the history the window prunes. The current keys
+    with no history in the window are not reported, like the keys with no history at all.
+    The earliest window start, from one aggregation of the current dataset, is applied as a
+    partition pruning filter and the window start by key is only joined when the current dataset
+    has several Current_dates. The keys are assumed
+    unique in the current dataset, a key with several Current_dates gets one window from its
+    earliest Current_date, wider than lookback_days for its later rows.
+    """
+    start_date = date.fromisoformat(since) if since else None
+    per_key = False
+    if lookback_days is not None:
+        first_date, last_date = dataset1.agg(
+            spark_min(col("Current_date")), spark_max(col("Current_date"))).first()
+        if first_date is not None:
+            lookback_date = first_date - timedelta(days=lookback_days)
+            start_date = max(start_date, lookback_date) if start_date else lookback_date
+            per_key = first_date != last_date
+    if start_date is not None:
+        dataset2 = filter_history_from(dataset2, start_date)
+    if per_key:
+        # History rows of keys without a Current_date are kept like with a single Current_date
+        if FLAGS_COLUMN in dataset2.columns:
+            history_date = col(DAY_COLUMN)
+            window_start = expr(f"unix_date(date_sub(Window_date, {lookback_days}))")
+        else:
+            history_date = col("Cob_date")
+            window_start = date_sub(col("Window_date"), lookback_days)
+        windows = dataset1.groupBy("Primary_key").agg(
+            spark_min(col("Current_date")).alias("Window_date"))
+        dataset2 = (
+            dataset2
+            .join(windows, "Primary_key", how='left')
+            .filter(col("Window_date").isNull() | (history_date >= window_start))
+            .drop("Window_date")
         )
-        .withColumnRenamed('max(a1)','Days_since_attribute_a')
-        .withColumnRenamed('max(b1)','Days_since_attribute_b')
-        .withColumnRenamed('max(c1)','Days_since_attribute_c')
+    return dataset2
+
+def log_dropped_keys(dataset1, key_results, args, persisted_datasets):
+    """
+    Caches the one row per key results of a truncated history and logs the count of the current
+    keys with no history in the window, which are not reported. The count joins the current keys
+    to the cached results, the history is still read once for the export. The results are
+    returned unchanged without a history window
+    """
+    if not args.get("since") and args.get("lookback_days") is None:
+        return key_results
+    key_results = key_results.cache()
+    persisted_datasets.append(key_results)
+    dropped_keys = dataset1.select("Primary_key").distinct() \
+        .join(key_results.select("Primary_key"), "Primary_key", how="left_anti").count()
+    if dropped_keys:
+        logger.info("%s current keys have no history in the window and are not reported",
+            dropped_keys)
+    return key_results
+
+def get_first_yes_days_since(dataset1, first_yes, attributes, broadcast_first_yes=True):
+    """
+    Returns the current dataset with the days since each attribute was first Yes from the
+    one row per key first Yes dates, which are small enough to be broadcast to the join unless
+    both datasets are bucketed alike and joined without an exchange.
+    Keys with no Yes yet or a first Yes after the Current_date report 0
+    """
+    def days_since(attribute):
+        return coalesce(
+            greatest(datediff(dataset1.Current_date, first_yes[first_yes_column(attribute)]),
+                lit(0)),
+            lit(0)
+        ).alias(days_since_column(attribute))
+
+    if broadcast_first_yes:
+        first_yes = broadcast(first_yes)
+    return (
+        dataset1
+        .join(first_yes, dataset1.Primary_key==first_yes.Primary_key, how='inner')
         .select(
-            "Primary_key",
-            "Days_since_attribute_a",
-            "Days_since_attribute_b",
-            "Days_since_attribute_c"
+            [dataset1.Primary_key] + [dataset1[x] for x in attributes] +
+            [dataset1.Current_date] + [days_since(x) for x in attributes]
         )
-        .orderBy("Primary_key")
     )
 
-    # Combines final result set into dataframe
-    results=dataset1.alias("dataset1").join(dataset_grouped, dataset1.Primary_key == \
-        dataset_grouped.Primary_key) \
-    .withColumn("Current_date",date_format(dataset1.Current_date,"MM/dd/yyyy")) \
-    .select("dataset1.Primary_key","Attribute_a","Attribute_B","Attribute_C","Current_date", \
-        "Days_since_attribute_a","Days_since_attribute_b","Days_since_attribute_c") \
-    .orderBy("dataset1.Primary_key")
+def get_delta(results, previous, attributes):
+    """
+    Returns the rows of the results that changed from the previous results with an Operation
+    column, insert for the new keys, delete with the previous row for the removed keys and update
+    for the keys whose attributes or first Yes dates changed. The days since of an unchanged
+    first Yes date grow with the days between both Current_dates and are not a change. The days
+    since only come from the history, so a previous days since of 0 is either a first Yes on the
+    previous Current_date, unchanged when it grows with the days between, or a key with no Yes
+    in its history, unchanged while it stays at 0, whatever the current attribute flags.
+    """
+    current = results.alias("current")
+    previous = previous.alias("previous")
+    elapsed = datediff(col("current.Current_date"), col("previous.Current_date"))
+    unchanged = lit(True)
+    for attribute in attributes:
+        now = col(f"current.{days_since_column(attribute)}")
+        before = col(f"previous.{days_since_column(attribute)}")
+        unchanged = unchanged & col(f"current.{attribute}").eqNullSafe(
+            col(f"previous.{attribute}")) & (
+            (now - before == elapsed) | ((before == 0) & (now == 0)))
+    removed = col("current.Primary_key").isNull()
+    operation = (
+        when(col("previous.Primary_key").isNull(), lit("insert"))
+        .when(removed, lit("delete"))
+        .when(~coalesce(unchanged, lit(False)), lit("update"))
+    )
+    columns = ["Primary_key"] + attributes + ["Current_date"] + \
+        [days_since_column(x) for x in attributes]
+    return (
+        current
+        .join(previous, col("current.Primary_key") == col("previous.Primary_key"),
+            how='full_outer')
+        .select([operation.alias("Operation")] + [
+            when(removed, col(f"previous.{x}")).otherwise(col(f"current.{x}")).alias(x)
+            for x in columns
+        ])
+        .filter(col("Operation").isNotNull())
+    )
 
-    # shows the final result set on the screen based on selected option
-    if args["show"] != "No":
-        trunc =  args["show"] == "Yes"
-        results.show(truncate=trunc)
+def get_cached_dataset(dataset_cache, dataset_path, options, loader):
+    """
+    Returns the dataset from the cache when its path and options were loaded before and the files
+    of the path and their modification time and size did not change, otherwise loads it with the
+    loader and caches it. The cache keeps the DATASET_CACHE_ENTRIES most recently used datasets,
+    the others are unpersisted.
+    """
+    if dataset_cache is None:
+        return loader()
+    key = (os.path.abspath(dataset_path), json.dumps(options))
+    version = [(x, os.stat(x).st_mtime_ns, os.stat(x).st_size)
+        for x in numpy_engine.get_input_files(dataset_path)]
+    if key in dataset_cache:
+        # The entry is inserted again to keep the dictionary in least recently used order
+        cached_version, dataset = dataset_cache.pop(key)
+        if cached_version == version:
+            logger.info("dataset loaded from cache - %s", dataset_path)
+            dataset_cache[key] = (cached_version, dataset)
+            return dataset
+        dataset.unpersist()
+    dataset = loader().cache()
+    dataset_cache[key] = (version, dataset)
+    while len(dataset_cache) > DATASET_CACHE_ENTRIES:
+        evicted_key = next(iter(dataset_cache))
+        dataset_cache.pop(evicted_key)[1].unpersist()
+        logger.info("dataset released from cache - %s", evicted_key[0])
+    return dataset
 
-    # Exports results to csv file based on result_path option
-    with tempfile.TemporaryDirectory(suffix="tmp") as tmp_dir:
-        temp_file = os.path.join(tmp_dir,"temp_file")
-        results.coalesce(1).write\
-        .options(header='True', dateFormat="MM/dd/yyyy")\
-        .mode("overwrite").csv(temp_file)
-        csv_file = [x for x in os.listdir(temp_file) if x.endswith(".csv")][0]
-        shutil.move(os.path.join(temp_file,csv_file), args["result_path"])
+def validate_paths(args):
+    """
+    Returns True once logged when the input paths or the files of the run options do not exist
+    """
+    call_error_found = False
+    if args.dataset1_path is None or not numpy_engine.get_input_files(args.dataset1_path):
+        logger.info("dataset1_path is required to match existing files")
+        call_error_found =  True
+    if args.dataset2_path is None or not numpy_engine.get_input_files(args.dataset2_path):
+        logger.info("dataset2_path is required to match existing files")
+        call_error_found =  True
+    elif args.file_date == "Yes" and (args.input_format not in ["auto", "csv"]
+        or get_input_format(args.dataset2_path) != "csv"):
+        logger.info("file_date is only supported for csv history datasets")
+        call_error_found =  True
+    if args.previous_result is not None and (not os.path.exists(args.previous_result)
+        or os.path.abspath(args.previous_result) == os.path.abspath(args.result_path)
+        or args.engine != "spark" or args.backfill_from is not None):
+        logger.info("previous_result is required to exist apart from result_path and is only "
+            "supported by the spark engine without backfill")
+        call_error_found =  True
+    if args.cache_mb < 0:
+        logger.info("cache_mb is required to be positive")
+        call_error_found =  True
+    if args.spark_config is not None and not os.path.isfile(args.spark_config):
+        logger.info("spark_config is required to exist")
+        call_error_found =  True
+    return call_error_found
 
-def get_dataset(dataset_path, schema, spark):
+def validate_window(args):
     """
-    Returns a dataframe of the provided csv file path with the provided schema
+    Returns True once logged when the history window options are invalid or conflict with the
+    state snapshot
     """
-    try:
-        return spark.read.options(header='True',dateFormat="MM/dd/yyyy")\
-        .schema(schema).csv(dataset_path)
-    except Exception as err: # pylint: disable=broad-except
-        logger.exception("dataset file failed to load - %s - %s", dataset_path, err)
-        sys.exit()
+    call_error_found = False
+    if args.since is not None:
+        try:
+            date.fromisoformat(args.since)
+        except ValueError:
+            logger.info("since is required to be a YYYY-MM-DD date")
+            call_error_found =  True
+    if args.lookback_days is not None and args.lookback_days < 0:
+        logger.info("lookback_days is required to be positive")
+        call_error_found =  True
+    if args.state_path is not None and (args.since is not None
+        or args.lookback_days is not None):
+        logger.info("state_path snapshot covers the full history and does not support since or "
+            "lookback_days")
+        call_error_found =  True
+    return call_error_found
 
-def validate_args(args):
+def validate_engine(args):
     """
-    Validates the input arguments to check file paths exists
+    Returns True once logged when the engine does not support the history or the options of the
+    run
     """
     call_error_found = False
-    if args.dataset1_path is None or not os.path.exists(args.dataset1_path):
-        logger.info("dataset1_path is required to exist")
+    indexed = args.dataset2_path is not None and os.path.isdir(args.dataset2_path) and \
+        numpy_engine.get_index(args.dataset2_path) is not None
+    if indexed and (args.engine != "numpy" or args.since is not None
+        or args.lookback_days is not None):
+        logger.info("history index is only supported by the numpy engine without since or "
+            "lookback_days")
+        call_error_found =  True
+    # The format of both datasets is resolved from their files in auto mode
+    input_formats = [get_input_format(x) if args.input_format == "auto" else args.input_format
+        for x in [args.dataset1_path, args.dataset2_path] if x is not None]
+    if args.engine == "numpy" and (args.state_path is not None
+        or any(x != "csv" for x in input_formats) or args.output_format != "csv"
+        or args.output_layout != "file"):
+        logger.info("numpy engine only supports csv datasets without state_path")
         call_error_found =  True
-    if args.dataset2_path is None or not os.path.exists(args.dataset2_path):
-        logger.info("dataset2_path is required to exist")
+    if args.plan == "legacy" and args.state_path is not None:
+        logger.info("legacy plan joins the full history and does not support state_path")
         call_error_found =  True
+    return call_error_found
+
+def parse_shard(args):
+    """
+    Returns the [index, shards] shard of the i/N shard option along with True once logged when
+    it is invalid or requested with options it does not support
+    """
+    if args.shard is None:
+        return None, False
+    try:
+        shard = [int(x) for x in args.shard.split("/")]
+    except ValueError:
+        shard = [0]
+    if len(shard) != 2 or not 0 <= shard[0] < shard[1]:
+        logger.info("shard is required to be i/N with 0 <= i < N")
+        return shard, True
+    # The merger streams the shard results in key order
+    if args.quality == "Yes" or args.backfill_from is not None or args.output_format != "csv" \
+        or args.sort == "No":
+        logger.info("shard is only supported for sorted csv results without quality checks or "
+            "backfill")
+        return shard, True
+    return shard, False
+
+def parse_attributes(args):
+    """
+    Returns the attribute names of the comma separated attributes option along with True once
+    logged when they are invalid or too many for the encoded history
+    """
+    attributes = [x.strip() for x in args.attributes.split(",")]
+    if "" in attributes or len(set(x.lower() for x in attributes)) != len(attributes):
+        logger.info("attributes are required to be unique non empty column names")
+        return attributes, True
+    if len(attributes) > MAX_ENCODED_ATTRIBUTES and args.dataset2_path is not None and \
+        os.path.isdir(args.dataset2_path) and get_encoding(args.dataset2_path) is not None:
+        logger.info("bitmask encoded history supports at most %s attributes",
+            MAX_ENCODED_ATTRIBUTES)
+        return attributes, True
+    return attributes, False
+
+def validate_args(args):
+    """
+    Validates the input arguments to check file paths exists
+    """
+    attributes, attributes_error = parse_attributes(args)
+    shard, shard_error = parse_shard(args)
+    # Every check runs so that all the argument errors are logged at once
+    call_error_found = any([validate_paths(args), validate_window(args), validate_engine(args),
+        validate_quality(args), validate_backfill(args), shard_error, attributes_error])
     if call_error_found:
         sys.exit(1)
     return {
             'dataset1_path': args.dataset1_path,
             'dataset2_path': args.dataset2_path,
             'result_path': args.result_path,
-            'show': args.show
+            'show': args.show,
+            'attributes': attributes,
+            'state_path': args.state_path,
+            'engine': args.engine,
+            'plan': args.plan,
+            'input_format': args.input_format,
+            'output_format': args.output_format,
+            'output_layout': args.output_layout,
+            'sort': args.sort,
+            'file_date': args.file_date,
+            'shard': shard,
+            'since': args.since,
+            'lookback_days': args.lookback_days,
+            'backfill_from': args.backfill_from,
+            'backfill_to': args.backfill_to,
+            'quality': args.quality,
+            'quarantine_path': args.quarantine_path,
+            'quality_threshold': args.quality_threshold,
+            'spark_profile': args.spark_profile,
+            'cache_dir': args.cache_dir,
+            'cache_mb': args.cache_mb,
+            'cache_hash': args.cache_hash,
+            **{x: getattr(args, y) for x, y in ARGUMENT_OPTIONS.items()}
         }
 
 if __name__ == '__main__':
-    main(validate_args(parse_input()))
+    try:
+        main(validate_args(parse_input()))
+    except QualityError as quality_error:
+        logger.info("data quality - %s", quality_error)
+        sys.exit(1)
     sys.exit()
@@ -0,0 +1,315 @@
+"""
+# Title : Code Assessment - Spark Datasets
+# Description : Reads, encodes and exports the current, history and result spark datasets
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import logging
+from pyspark.sql.functions import when, date_format, col, lit, expr, to_date
+from pyspark.sql.functions import input_file_name, regexp_extract, concat_ws
+from pyspark.sql.types import StructType, StringType, IntegerType, DateType
+from pyspark.sql.pandas.types import to_arrow_schema
+import numpy_engine
+import bucketing
+
+logger = logging.getLogger()
+
+# Encoded history columns, the attribute flags of a row packed in one bitmask and the Cob_date
+# as a day number since 1970-01-01
+FLAGS_COLUMN = "Attribute_flags"
+DAY_COLUMN = "Cob_day"
+# Attributes packed in the signed long bitmask, bit 63 is the sign bit
+MAX_ENCODED_ATTRIBUTES = 63
+ENCODING_FILE = "_encoding.json"
+# Rows by pyarrow record batch of the batches output of creator.compute
+BATCH_ROWS = 65536
+
+def export_results(results, result_path, output_format, output_layout="file"):
+    """
+    Exports the results to a single csv file, a multi-part csv directory or to a parquet or orc
+    dataset directory
+    """
+    if output_format != "csv":
+        results.write.mode("overwrite").format(output_format).save(result_path)
+        return
+
+    if "Current_date" in results.columns:
+        results = results.withColumn("Current_date",
+            date_format(col("Current_date"),"MM/dd/yyyy"))
+    if output_layout == "directory":
+        results.write.options(header='True', dateFormat="MM/dd/yyyy")\
+        .mode("overwrite").csv(result_path)
+        return
+
+    # Exports the sorted partitions in parallel next to result_path and joins the part files
+    # in partition order, which is the key order, into the single result csv file
+    result_dir = os.path.dirname(os.path.abspath(result_path))
+    with tempfile.TemporaryDirectory(suffix="tmp", dir=result_dir) as tmp_dir:
+        temp_file = os.path.join(tmp_dir,"temp_file")
+        results.write\
+        .options(header='True', dateFormat="MM/dd/yyyy")\
+        .mode("overwrite").csv(temp_file)
+        csv_files = sorted(x for x in os.listdir(temp_file) if x.endswith(".csv"))
+        concat_csv_files([os.path.join(temp_file,x) for x in csv_files], result_path)
+
+def concat_csv_files(csv_files, result_path):
+    """
+    Streams the csv files into result_path in the provided order keeping a single header
+    """
+    header = None
+    with open(result_path, "wb") as result_file:
+        for csv_file in csv_files:
+            with open(csv_file, "rb") as part_file:
+                first_line = part_file.readline()
+                if header is None:
+                    header = first_line
+                    result_file.write(header)
+                elif first_line != header:
+                    result_file.write(first_line)
+                shutil.copyfileobj(part_file, result_file, 1024 * 1024)
+
+def days_since_column(attribute):
+    """
+    Returns the result column name of the days since the attribute was first Yes
+    """
+    return f"Days_since_{attribute.lower()}"
+
+def first_yes_column(attribute):
+    """
+    Returns the first Yes state column name of the attribute
+    """
+    return f"First_yes_{attribute.lower()}"
+
+def filter_history_from(dataset2, start_date):
+    """
+    Returns the history rows from the start date on, a plain filter on the Cob_date or Cob_day
+    column which prunes the partitions of a partitioned history
+    """
+    if FLAGS_COLUMN in dataset2.columns:
+        return dataset2.filter(
+            col(DAY_COLUMN) >= expr(f"unix_date(DATE'{start_date.isoformat()}')"))
+    return dataset2.filter(col("Cob_date") >= lit(start_date))
+
+def filter_history_to(dataset2, end_date):
+    """
+    Returns the history rows up to the end date, pruning the later partitions
+    """
+    if FLAGS_COLUMN in dataset2.columns:
+        return dataset2.filter(
+            col(DAY_COLUMN) <= expr(f"unix_date(DATE'{end_date.isoformat()}')"))
+    return dataset2.filter(col("Cob_date") <= lit(end_date))
+
+def get_schema(date_column, attributes=None):
+    """
+    Returns the schema of the current (Current_date) or history (Cob_date) dataset
+    """
+    schema = StructType()
+    schema.add('Primary_key', IntegerType(), True)
+    for attribute in attributes or numpy_engine.ATTRIBUTES:
+        schema.add(attribute, StringType(), True)
+    schema.add(date_column, DateType(), True)
+    return schema
+
+def get_raw_schema(date_column, attributes=None):
+    """
+    Returns the schema of the current or history dataset with every column read as a string
+    """
+    schema = StructType()
+    for field in get_schema(date_column, attributes).fields:
+        schema.add(field.name, StringType(), True)
+    return schema
+
+def get_result_schema(attributes=None):
+    """
+    Returns the schema of the results, the current dataset with the days since columns
+    """
+    schema = get_schema("Current_date", attributes)
+    for attribute in attributes or numpy_engine.ATTRIBUTES:
+        schema.add(days_since_column(attribute), IntegerType(), True)
+    return schema
+
+def encode_attributes(dataset, attributes, date_column="Cob_date"):
+    """
+    Returns the dataset with the Yes/No attributes packed in one bitmask column, bit i set for
+    a Yes of attributes[i], and the date column as a day number since 1970-01-01
+    """
+    if len(attributes) > MAX_ENCODED_ATTRIBUTES:
+        raise ValueError(f"at most {MAX_ENCODED_ATTRIBUTES} attributes can be bitmask encoded, "
+            f"got {len(attributes)}")
+    flags = lit(0)
+    for index, attribute in enumerate(attributes):
+        flags = flags.bitwiseOR(when(col(attribute)=="Yes", lit(1 << index)).otherwise(lit(0)))
+    return dataset.select(
+        col("Primary_key"),
+        flags.cast("int" if len(attributes) < 32 else "long").alias(FLAGS_COLUMN),
+        expr(f"unix_date({date_column})").alias(DAY_COLUMN)
+    )
+
+def decode_attributes(dataset, attributes):
+    """
+    Returns the history dataset with the attribute bitmask and day number decoded back to the
+    Yes/No attributes and Cob_date, datasets that are not encoded are returned unchanged
+    """
+    if FLAGS_COLUMN not in dataset.columns:
+        return dataset
+    return dataset.select(
+        [col("Primary_key")] + [
+            when(col(FLAGS_COLUMN).bitwiseAND(1 << index) != 0, lit("Yes")).otherwise(
+                lit("No")).alias(attribute)
+            for index, attribute in enumerate(attributes)
+        ] + [expr(f"date_from_unix_date({DAY_COLUMN})").alias("Cob_date")]
+    )
+
+def get_encoding(dataset_path):
+    """
+    Returns the attributes in bit order of an encoded history dataset or None when the
+    dataset is not encoded
+    """
+    encoding_path = os.path.join(dataset_path, ENCODING_FILE)
+    if not os.path.isfile(encoding_path):
+        return None
+    with open(encoding_path, encoding="utf8") as encoding_file:
+        return json.load(encoding_file)["attributes"]
+
+def write_encoding(dataset_path, attributes):
+    """
+    Records the attributes in bit order next to an encoded history dataset
+    """
+    with open(os.path.join(dataset_path, ENCODING_FILE), "w", encoding="utf8") as encoding_file:
+        json.dump({"attributes": attributes}, encoding_file)
+
+def get_history(dataset_path, attributes, spark, input_format="csv", file_date="No"):
+    """
+    Returns the history dataset, an encoded columnar history is kept encoded with its bits
+    reordered to the order of the provided attributes. With file_date the Cob_date is taken
+    from the file names and the Cob_date column is pruned from the csv parsing.
+    """
+    encoding = get_encoding(dataset_path)
+    if encoding is None:
+        dataset = get_dataset(dataset_path, get_schema("Cob_date", attributes), spark,
+            input_format)
+        if file_date == "Yes":
+            dataset = dataset.withColumn("Cob_date", get_file_date())
+        return dataset
+
+    missing = [x for x in attributes if x not in encoding]
+    if missing:
+        logger.info("encoded history has no flags for %s - %s", missing, dataset_path)
+        sys.exit(1)
+    if input_format == "auto":
+        input_format = get_input_format(dataset_path)
+    dataset = read_columnar(dataset_path, spark, input_format)
+    flags = col(FLAGS_COLUMN)
+    if encoding[:len(attributes)] != attributes:
+        flags = lit(0)
+        for index, attribute in enumerate(attributes):
+            flags = flags.bitwiseOR(when(
+                col(FLAGS_COLUMN).bitwiseAND(1 << encoding.index(attribute)) != 0,
+                lit(1 << index)).otherwise(lit(0)))
+    return dataset.select(
+        col("Primary_key").cast("int"),
+        flags.alias(FLAGS_COLUMN),
+        col(DAY_COLUMN).cast("int")
+    )
+
+def get_file_date():
+    """
+    Returns the date column of the yyyy-MM-dd or yyyyMMdd date of the input file name of the
+    rows, null when the name holds no valid date
+    """
+    return to_date(concat_ws("-", *[
+        regexp_extract(input_file_name(), numpy_engine.FILE_DATE_PATTERN, x) for x in [1, 2, 3]
+    ]), "yyyy-MM-dd")
+
+def get_input_format(dataset_path):
+    """
+    Returns the input format of the provided path from its file extension, a directory or glob
+    pattern takes the format of the first data file found in it
+    """
+    input_files = numpy_engine.get_input_files(dataset_path)
+    if not input_files:
+        return "csv"
+    extension = os.path.splitext(input_files[0])[1].lower()
+    if extension in (".parquet", ".pq"):
+        return "parquet"
+    if extension == ".orc":
+        return "orc"
+    return "csv"
+
+def read_columnar(dataset_path, spark, input_format):
+    """
+    Returns the parquet or orc dataset of the path, a bucketed dataset is read through its
+    session table so that spark knows its rows are already distributed by Primary_key
+    """
+    bucketed = bucketing.get_bucketing(dataset_path) if os.path.isdir(dataset_path) else None
+    if bucketed is not None:
+        return spark.table(bucketing.register_bucketed(spark, dataset_path, bucketed))
+    return spark.read.format(input_format).load(dataset_path)
+
+def get_dataset(dataset_path, schema, spark, input_format="csv"):
+    """
+    Returns a dataframe of the provided csv, parquet or orc path with the provided schema.
+    Columnar inputs only read the schema columns, a history partitioned by Cob_date gets
+    its date filters pushed down to the partition directories
+    """
+    if input_format == "auto":
+        input_format = get_input_format(dataset_path)
+    try:
+        if input_format == "csv":
+            return spark.read.options(header='True',dateFormat="MM/dd/yyyy")\
+            .schema(schema).csv(dataset_path)
+        return read_columnar(dataset_path, spark, input_format)\
+        .select([col(field.name).cast(field.dataType) for field in schema.fields])
+    except Exception as err: # pylint: disable=broad-except
+        logger.exception("dataset file failed to load - %s - %s", dataset_path, err)
+        sys.exit()
+
+def get_arrow_ipc(results, batch_rows=BATCH_ROWS):
+    """
+    Returns a spark dataframe of the results serialized per partition as arrow ipc streams of
+    up to batch_rows rows, in the results order. The executors build the arrow batches from the
+    pandas frames of mapInPandas, so the rows never go through driver python rows.
+    """
+    schema = to_arrow_schema(results.schema)
+
+    def to_ipc(frames):
+        import pandas # pylint: disable=import-outside-toplevel
+        import pyarrow # pylint: disable=import-outside-toplevel
+        frames = list(frames)
+        if not frames:
+            return
+        table = pyarrow.Table.from_pandas(pandas.concat(frames), schema=schema,
+            preserve_index=False)
+        for batch in table.to_batches(max_chunksize=batch_rows):
+            sink = pyarrow.BufferOutputStream()
+            with pyarrow.ipc.new_stream(sink, schema) as writer:
+                writer.write_batch(batch)
+            yield pandas.DataFrame({"Batch": [sink.getvalue().to_pybytes()]})
+
+    return results.mapInPandas(to_ipc, "Batch binary")
+
+def get_arrow_table(results):
+    """
+    Returns the results collected as a pyarrow table from their arrow ipc batches
+    """
+    import pyarrow # pylint: disable=import-outside-toplevel
+    return pyarrow.Table.from_batches([
+        pyarrow.ipc.open_stream(row.Batch).read_next_batch()
+        for row in get_arrow_ipc(results).collect()
+    ], schema=to_arrow_schema(results.schema))
+
+def iter_arrow_batches(results, batch_rows=BATCH_ROWS):
+    """
+    Yields the results as pyarrow record batches of up to batch_rows rows, the partitions are
+    fetched one at a time while the batches are consumed
+    """
+    import pyarrow # pylint: disable=import-outside-toplevel
+    for row in get_arrow_ipc(results, batch_rows).toLocalIterator(prefetchPartitions=True):
+        yield pyarrow.ipc.open_stream(row.Batch).read_next_batch()
@@ -0,0 +1,170 @@
+"""
+# Title : Code Assessment - History Index
+# Description : Builds the memory mapped first Yes history index read by the numpy engine
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import textwrap
+import sys
+import os
+import argparse
+import json
+import shutil
+import numpy as np
+import numpy_engine
+from creator import logger
+
+def parse_input():
+    """
+    Parse script arguments
+    """
+    parser =  argparse.ArgumentParser(
+        prog=sys.argv[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+example:
+    # Build the history index of a history csv file
+    python3 ./history_index.py -i dataset2.csv -o dataset2.index
+
+    # Fold a new Cob_date slice into the index
+    python3 ./history_index.py -i daily_slice.csv -o dataset2.index --mode append
+
+    # Fold the daily files not indexed yet, with the Cob_date taken from their file name
+    python3 ./history_index.py -i "history/*.csv.gz" -o dataset2.index --mode append --file_date Yes
+
+    # Run the numpy engine on the index instead of parsing the history csv file
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.index -r results.csv --engine numpy
+    ''')
+    )
+
+    parser.add_argument("-i","--input_path", help="History input csv file, directory or glob "
+        "pattern path, gzip and bz2 files are decompressed", required=True)
+    parser.add_argument("-o","--output_path", help="History index directory path",
+        required=True)
+    parser.add_argument("-a","--attributes", help="Comma separated Yes/No attribute columns "
+        "between Primary_key and Cob_date", default=",".join(numpy_engine.ATTRIBUTES),
+        required=False)
+    parser.add_argument("-m","--mode", help="Output mode, append folds the history rows into "
+        "an existing index of the same attributes",
+        choices = ["overwrite", "append"], default="overwrite", required=False)
+    parser.add_argument("-fd","--file_date", help="Take the Cob_date of the rows from the "
+        "yyyy-MM-dd or yyyyMMdd date of their file name instead of parsing the column",
+        choices = ["No", "Yes"], default="No", required=False)
+    args = parser.parse_args()
+    return args
+
+def build_index(args):
+    """
+    Reduces the history csv file to its sorted keys and the earliest Yes day number of each
+    attribute by key, merged with the existing index in append mode, and writes them as .npy
+    files that the numpy engine memory maps. The new index is written next to the previous
+    one and swapped in once complete. In append mode the input files already indexed are
+    skipped.
+    """
+    attributes = args.get("attributes", numpy_engine.ATTRIBUTES)
+    chunk_rows = args.get("chunk_rows", numpy_engine.CHUNK_ROWS)
+    index_path = args["output_path"]
+    manifest = {"attributes": attributes, "rows": 0, "sources": []}
+    keys = np.empty(0, dtype=np.int64)
+    first_yes = np.empty((len(attributes), 0), dtype=np.int32)
+    input_files = numpy_engine.get_input_files(args["input_path"])
+
+    if args.get("mode", "overwrite") == "append" and os.path.isdir(index_path):
+        manifest = numpy_engine.validate_index(index_path, [])
+        if manifest["attributes"] != attributes:
+            logger.info("appended rows are required to match the attributes of the index %s - %s",
+                manifest["attributes"], index_path)
+            sys.exit(1)
+        indexed = [x["fingerprint"] for x in manifest["sources"]]
+        input_files = [x for x in input_files
+            if numpy_engine.get_fingerprint(x) not in indexed]
+        if not input_files:
+            logger.info("history already indexed - %s - %s", args["input_path"], index_path)
+            return
+        keys = np.load(os.path.join(index_path, numpy_engine.INDEX_KEYS_FILE))
+        first_yes = np.stack([
+            np.load(os.path.join(index_path, numpy_engine.index_file(x))) for x in attributes
+        ]) if attributes else first_yes
+
+    history_dtype = numpy_engine.get_dtype("Cob_date", attributes, "S4")
+    for input_file in input_files:
+        for chunk in numpy_engine.read_csv_chunks(input_file, history_dtype, chunk_rows,
+            args.get("file_date", "No")):
+            manifest["rows"] += len(chunk)
+            keys, first_yes = merge_first_yes(keys, first_yes, *reduce_chunk(chunk, attributes))
+        manifest["sources"].append({
+            "path": os.path.abspath(input_file),
+            "fingerprint": numpy_engine.get_fingerprint(input_file)
+        })
+    write_index(index_path, manifest, keys, first_yes)
+    logger.info("history indexed - %s - %s", args["input_path"], index_path)
+
+def reduce_chunk(chunk, attributes):
+    """
+    Returns the sorted keys of the history chunk and the earliest Yes day number of each
+    attribute by key
+    """
+    keys, key_index = np.unique(chunk["Primary_key"], return_inverse=True)
+    cob_days = numpy_engine.parse_dates(chunk["Cob_date"])
+    first_yes = np.full((len(attributes), len(keys)), numpy_engine.NO_INDEX_DATE,
+        dtype=np.int32)
+    for attribute_index, attribute in enumerate(attributes):
+        yes = (chunk[attribute] == b"Yes") & (cob_days != numpy_engine.NO_DATE)
+        np.minimum.at(first_yes[attribute_index], key_index[yes], cob_days[yes])
+    return keys, first_yes
+
+def merge_first_yes(keys, first_yes, chunk_keys, chunk_first_yes):
+    """
+    Returns the union of the sorted keys and the earliest Yes day numbers of both
+    """
+    merged_keys = np.union1d(keys, chunk_keys)
+    merged = np.full((len(first_yes), len(merged_keys)), numpy_engine.NO_INDEX_DATE,
+        dtype=np.int32)
+    merged[:, np.searchsorted(merged_keys, keys)] = first_yes
+    chunk_index = np.searchsorted(merged_keys, chunk_keys)
+    merged[:, chunk_index] = np.minimum(merged[:, chunk_index], chunk_first_yes)
+    return merged_keys, merged
+
+def write_index(index_path, manifest, keys, first_yes):
+    """
+    Writes the index files and manifest to a new directory then replaces the previous index
+    """
+    new_index_path = index_path.rstrip(os.sep) + ".new"
+    if os.path.exists(new_index_path):
+        shutil.rmtree(new_index_path)
+    os.makedirs(new_index_path)
+    np.save(os.path.join(new_index_path, numpy_engine.INDEX_KEYS_FILE), keys)
+    for attribute_index, attribute in enumerate(manifest["attributes"]):
+        np.save(os.path.join(new_index_path, numpy_engine.index_file(attribute)),
+            first_yes[attribute_index])
+    with open(os.path.join(new_index_path, numpy_engine.INDEX_FILE), "w",
+        encoding="utf8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    if os.path.exists(index_path):
+        shutil.rmtree(index_path)
+    os.rename(new_index_path, index_path)
+
+def validate_args(args):
+    """
+    Validates the input arguments to check file paths exists
+    """
+    if args.input_path is None or not numpy_engine.get_input_files(args.input_path):
+        logger.info("input_path is required to match existing csv files")
+        sys.exit(1)
+    if args.mode == "append" and os.path.exists(args.output_path) and \
+        numpy_engine.get_index(args.output_path) is None:
+        logger.info("output_path is required to be a history index in append mode")
+        sys.exit(1)
+    return {
+            'input_path': args.input_path,
+            'output_path': args.output_path,
+            'attributes': [x.strip() for x in args.attributes.split(",")],
+            'mode': args.mode,
+            'file_date': args.file_date
+        }
+
+if __name__ == '__main__':
+    build_index(validate_args(parse_input()))
+    sys.exit()
@@ -0,0 +1,101 @@
+"""
+# Title : Code Assessment - Shard Merger
+# Description : K-way merge of the key sorted shard results of creator.py into one result
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import textwrap
+import sys
+import os
+import argparse
+import heapq
+import verifier
+
+def parse_input():
+    """
+    Parse script arguments
+    """
+    parser =  argparse.ArgumentParser(
+        prog=sys.argv[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+example:
+    # Run each shard of the Primary_key values on its own machine
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r results_0.csv --shard 0/2
+    python3 ./creator.py -ds1 dataset1.csv -ds2 dataset2.csv -r results_1.csv --shard 1/2
+
+    # Merge the sorted shard results into one result csv file in Primary_key order
+    python3 ./merger.py -i results_0.csv results_1.csv -r results.csv
+    ''')
+    )
+
+    parser.add_argument("-i","--input_paths", help="Shard result csv files or part files "
+        "directories sorted by Primary_key", nargs="+", required=True)
+    parser.add_argument("-r","--result_path", help="Merged result csv file path",
+        required=True)
+    args = parser.parse_args()
+    return args
+
+def iter_keyed_lines(csv_path, header):
+    """
+    Yields the (Primary_key, line) pairs of the data lines of a shard result, after checking its
+    header and that its keys are in order
+    """
+    lines = verifier.iter_lines(csv_path)
+    if next(lines, None) != header:
+        raise ValueError(f"shard result header differs from the first shard - {csv_path}")
+    previous_key = None
+    for line in lines:
+        key = int(verifier.get_key(line))
+        if previous_key is not None and key < previous_key:
+            raise ValueError(f"shard result is not sorted by Primary_key - {csv_path}")
+        previous_key = key
+        yield key, line
+
+def merge(input_paths, result_path):
+    """
+    Streams the rows of the key sorted shard results into result_path in Primary_key order with
+    a single header and returns the row count. A key only belongs to one shard, so the result is
+    the same as the sorted result of a single run.
+    """
+    header = next(verifier.iter_lines(input_paths[0]))
+    count = 0
+    with open(result_path, "wb") as result_file:
+        if header:
+            result_file.write(header + b"\n")
+        for _, line in heapq.merge(*[iter_keyed_lines(x, header) for x in input_paths],
+            key=lambda x: x[0]):
+            result_file.write(line + b"\n")
+            count += 1
+    return count
+
+def validate_args(args):
+    """
+    Validates the input arguments to check file paths exists
+    """
+    call_error_found = False
+    for input_path in args.input_paths:
+        if not os.path.exists(input_path):
+            print(f"input_path is required to exist - {input_path}")
+            call_error_found = True
+    if any(os.path.abspath(x) == os.path.abspath(args.result_path) for x in args.input_paths):
+        print("result_path is required to be apart from the input_paths")
+        call_error_found = True
+    if call_error_found:
+        sys.exit(1)
+    return {
+            'input_paths': args.input_paths,
+            'result_path': args.result_path
+        }
+
+if __name__ == '__main__':
+    merger_args = validate_args(parse_input())
+    try:
+        print(f"{merge(merger_args['input_paths'], merger_args['result_path'])} rows merged "
+            f"into {merger_args['result_path']}")
+    except ValueError as err:
+        print(f"shard results failed to merge - {err}")
+        sys.exit(1)
+    sys.exit()
@@ -0,0 +1,189 @@
+"""
+# Title : Code Assessment - Run Metrics
+# Description : Collects the per stage metrics of a creator run into a json report
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import json
+import time
+import cProfile
+import pstats
+import logging
+import uuid
+import urllib.request
+from datetime import datetime
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+# Spark task metrics of each spark stage, summed over the spark stages run by each stage of the
+# report
+SPARK_STAGE_METRICS = {
+    "inputRecords": "input_rows",
+    "inputBytes": "input_bytes",
+    "outputRecords": "output_rows",
+    "outputBytes": "output_bytes",
+    "shuffleReadBytes": "shuffle_read_bytes",
+    "shuffleWriteBytes": "shuffle_write_bytes",
+    "memoryBytesSpilled": "memory_spilled_bytes",
+    "diskBytesSpilled": "disk_spilled_bytes",
+    "executorRunTime": "executor_run_ms"
+}
+# Timestamp format of the spark status REST api
+SPARK_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%Z"
+# Attempts and seconds between them while the spark status store catches up with the last jobs
+SPARK_STATUS_ATTEMPTS = 10
+SPARK_STATUS_INTERVAL = 0.2
+PROFILE_FUNCTIONS = 25
+
+class RunMetrics:
+    """
+    Per stage wall times and row counts of a run along with the run options, written as a json
+    report. When a spark context is attached the spark jobs of each stage are tagged with a job
+    group and their task metrics are read back from the spark status REST api.
+    """
+    def __init__(self, options=None):
+        self.start_time = time.perf_counter()
+        self.report = {"options": options or {}, "stages": []}
+        self.run_id = uuid.uuid4().hex
+        self.spark_context = None
+        self.spark_stage_ids = {}
+
+    def attach_spark(self, spark_context):
+        """
+        Collects the spark task metrics of the stages run from now on
+        """
+        self.spark_context = spark_context
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the enclosed block as the named stage, the yielded dictionary takes the stage
+        counters such as row counts
+        """
+        counters = {}
+        job_group = f"creator-{self.run_id}-{name}"
+        if self.spark_context is not None:
+            self.spark_context.setJobGroup(job_group, name)
+        start_time = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            self.report["stages"].append(dict({
+                "name": name,
+                "seconds": round(time.perf_counter() - start_time, 3)
+            }, **counters))
+            if self.spark_context is not None:
+                self.spark_context.setLocalProperty("spark.jobGroup.id", None)
+                self.spark_stage_ids[name] = self.get_spark_stage_ids(job_group)
+
+    def get_spark_stage_ids(self, job_group):
+        """
+        Returns the ids of the spark stages of the jobs run under the job group
+        """
+        tracker = self.spark_context.statusTracker()
+        stage_ids = []
+        for job_id in tracker.getJobIdsForGroup(job_group):
+            job_info = tracker.getJobInfo(job_id)
+            if job_info is not None:
+                stage_ids.extend(job_info.stageIds)
+        return stage_ids
+
+    def collect_spark_metrics(self):
+        """
+        Adds the task metrics of each spark stage run by each report stage along with their sums
+        as the report stage totals, skipped with a warning when the spark ui is disabled or not
+        reachable
+        """
+        stage_ids = {x for ids in self.spark_stage_ids.values() for x in ids}
+        if not stage_ids:
+            return
+        ui_url = self.spark_context.uiWebUrl
+        if ui_url is None:
+            logger.warning("spark ui disabled, spark stage metrics not collected")
+            return
+        stages_url = f"{ui_url}/api/v1/applications/{self.spark_context.applicationId}/stages"
+        try:
+            for _ in range(SPARK_STATUS_ATTEMPTS):
+                with urllib.request.urlopen(stages_url, timeout=10) as response:
+                    spark_stages = {x["stageId"]: x for x in json.load(response)
+                        if x["stageId"] in stage_ids}
+                if all(spark_stages.get(x, {}).get("status") not in [None, "ACTIVE", "PENDING"]
+                    for x in stage_ids):
+                    break
+                time.sleep(SPARK_STATUS_INTERVAL)
+        except (OSError, ValueError) as err:
+            logger.warning("spark stage metrics not collected - %s", err)
+            return
+
+        for stage in self.report["stages"]:
+            ids = self.spark_stage_ids.get(stage["name"])
+            if not ids:
+                continue
+            stage["spark_stages"] = [get_spark_stage(spark_stages.get(x, {"stageId": x}))
+                for x in sorted(set(ids))]
+            for name in SPARK_STAGE_METRICS.values():
+                stage[name] = sum(x[name] for x in stage["spark_stages"])
+
+    @contextmanager
+    def profile(self, profile_path):
+        """
+        Profiles the driver python code of the enclosed block with cProfile when a profile path
+        is provided, the stats are dumped to the path and the top cumulative functions are added
+        to the report
+        """
+        if profile_path is None:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            stats = pstats.Stats(profiler)
+            self.report["profile"] = [
+                {
+                    "function": f"{file_name}:{line}({function})",
+                    "calls": calls,
+                    "total_seconds": round(total_time, 3),
+                    "cumulative_seconds": round(cumulative_time, 3)
+                }
+                for (file_name, line, function), (_, calls, total_time, cumulative_time, _)
+                in sorted(stats.stats.items(), key=lambda x: x[1][3], reverse=True) # pylint: disable=no-member
+                [:PROFILE_FUNCTIONS]
+            ]
+
+    def write(self, metrics_path):
+        """
+        Writes the json report with the total wall time of the run
+        """
+        if self.spark_context is not None:
+            self.collect_spark_metrics()
+        self.report["total_seconds"] = round(time.perf_counter() - self.start_time, 3)
+        with open(metrics_path, "w", encoding="utf8") as metrics_file:
+            json.dump(self.report, metrics_file, indent=2)
+
+def get_spark_stage(spark_stage):
+    """
+    Returns the id, name, description, task metrics and duration of a spark stage of the spark
+    status REST api, the duration is None while the stage is not complete
+    """
+    duration_ms = None
+    if spark_stage.get("submissionTime") and spark_stage.get("completionTime"):
+        duration_ms = round((
+            datetime.strptime(spark_stage["completionTime"], SPARK_TIME_FORMAT) -
+            datetime.strptime(spark_stage["submissionTime"], SPARK_TIME_FORMAT)
+        ).total_seconds() * 1000)
+    return dict({
+        "stage_id": spark_stage["stageId"],
+        "name": spark_stage.get("name"),
+        "description": spark_stage.get("description"),
+        "status": spark_stage.get("status"),
+        "tasks": spark_stage.get("numTasks", 0),
+        "duration_ms": duration_ms
+    }, **{name: spark_stage.get(spark_name, 0)
+        for spark_name, name in SPARK_STAGE_METRICS.items()})
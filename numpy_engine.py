@@ -0,0 +1,424 @@
+"""
+# Title : Code Assessment - NumPy Engine
+# Description : Single node engine computing the creator results without a Spark session
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import itertools
+import logging
+import os
+import sys
+import json
+import hashlib
+import glob
+import gzip
+import bz2
+import re
+import multiprocessing
+from collections import namedtuple
+from datetime import date
+import numpy as np
+
+logger = logging.getLogger()
+
+CHUNK_ROWS = 1000000
+NO_DATE = np.iinfo(np.int64).max
+# Primary_key range of the spark IntegerType, spark reads the keys out of it as null and drops
+# their rows, so do the csv readers
+MIN_KEY = np.iinfo(np.int32).min
+MAX_KEY = np.iinfo(np.int32).max
+# Days from 0000-03-01 to 1970-01-01 in the proleptic gregorian calendar
+EPOCH_SHIFT = 719468
+
+ATTRIBUTES = ["Attribute_a", "Attribute_B", "Attribute_C"]
+# History index directory manifest, the index holds the sorted keys and the earliest Yes day
+# number of each attribute by key as fixed width .npy files (see history_index.py)
+INDEX_FILE = "_index.json"
+INDEX_KEYS_FILE = "keys.npy"
+NO_INDEX_DATE = np.iinfo(np.int32).max
+# Bytes hashed at both ends of a source file for its fingerprint
+FINGERPRINT_BYTES = 1 << 20
+# Compressed input files by extension, as read by spark
+COMPRESSED_OPENERS = {".gz": gzip.open, ".bz2": bz2.open}
+# yyyy-MM-dd or yyyyMMdd date of the file name of a history file taken as its Cob_date, the
+# same java and python regular expression is applied to the file path by both engines
+FILE_DATE_PATTERN = r"(\d{4})-?(\d{2})-?(\d{2})[^/]*$"
+# Settings of a streamed history reduction, passed as one picklable value to the worker
+# processes, window_start is the earliest day number by key or None without a window
+HistoryScan = namedtuple("HistoryScan", ["attributes", "chunk_rows", "window_start", "file_date"])
+
+def main(args, metrics):
+    """
+    Computes the days since each attribute was first Yes by Primary_key of the current dataset
+    with vectorized group reductions and exports the results to the same csv as the spark engine
+    """
+    chunk_rows = args.get("chunk_rows", CHUNK_ROWS)
+    attributes = args.get("attributes", ATTRIBUTES)
+    with metrics.stage("current") as stage:
+        current = read_current(args["dataset1_path"], attributes, chunk_rows, args.get("shard"))
+        current_days = parse_dates(current["Current_date"])
+
+        # Unique keys are the group index of the reductions, current rows map back to it
+        keys, key_index = np.unique(current["Primary_key"], return_inverse=True)
+        stage["input_rows"] = len(current)
+    with metrics.stage("history") as stage:
+        scan = HistoryScan(attributes, chunk_rows, get_window_start(keys, key_index,
+            current_days, args.get("since"), args.get("lookback_days")),
+            args.get("file_date", "No"))
+        if get_index(args["dataset2_path"]) is not None:
+            first_yes, seen, stage["input_rows"] = get_indexed_first_yes(keys,
+                args["dataset2_path"], attributes)
+        else:
+            first_yes, seen, stage["input_rows"] = get_first_yes(keys, args["dataset2_path"],
+                scan, args.get("workers"))
+
+    with metrics.stage("results") as stage:
+        days_since = get_days_since(first_yes[:, key_index], current_days)
+
+        # Inner join semantics, current keys with no history are not reported
+        rows = np.flatnonzero(seen[key_index])
+        if scan.window_start is not None and not seen.all():
+            logger.info("%s current keys have no history in the window and are not reported",
+                np.count_nonzero(~seen))
+        if args.get("sort", "Yes") == "Yes":
+            rows = rows[np.argsort(current["Primary_key"][rows], kind="stable")]
+        results = [
+            [str(current["Primary_key"][i])] +
+            [csv_value(current[attribute][i]) for attribute in attributes] +
+            [format_date(current_days[i])] +
+            [str(days[i]) for days in days_since]
+            for i in rows
+        ]
+
+    if args["show"] != "No":
+        show_results(get_header(attributes), results, args["show"] == "Yes")
+
+    with metrics.stage("export") as stage:
+        stage["output_rows"] = len(results)
+        export_results(args["result_path"], get_header(attributes), results, chunk_rows)
+
+def get_header(attributes):
+    """
+    Returns the result columns, the same as the spark engine exports
+    """
+    return ["Primary_key"] + attributes + ["Current_date"] + [
+        f"Days_since_{attribute.lower()}" for attribute in attributes
+    ]
+
+def read_current(dataset1_path, attributes, chunk_rows, shard=None):
+    """
+    Returns the rows of the current dataset in the shard as one structured array, the current
+    attributes are kept as read with no length limit to be written back unchanged
+    """
+    current_dtype = get_dtype("Current_date", attributes, "O")
+    return np.concatenate([
+        filter_shard(x, shard) for x in read_csv_chunks(dataset1_path, current_dtype, chunk_rows)
+    ] or [np.empty(0, dtype=current_dtype)])
+
+def get_days_since(row_first_yes, current_days):
+    """
+    Returns the days since of each attribute for the current rows from the earliest Yes day
+    numbers of their keys. Keys with no Yes yet or a first Yes after the Current_date report 0
+    like both spark plans, so do rows with a malformed Current_date.
+    """
+    missing = (row_first_yes == NO_DATE) | (current_days == NO_DATE)
+    return np.where(missing, 0, np.maximum(current_days - row_first_yes, 0))
+
+def export_results(result_path, header, results, chunk_rows):
+    """
+    Writes the header and the result rows to the csv result file by chunks of chunk_rows rows
+    """
+    with open(result_path, "w", encoding="utf8") as result_file:
+        result_file.write(",".join(header) + "\n")
+        for chunk_start in range(0, len(results), chunk_rows):
+            result_file.write("".join(
+                ",".join(result) + "\n" for result in results[chunk_start:chunk_start + chunk_rows]
+            ))
+
+def get_dtype(date_column, attributes, attribute_type):
+    """
+    Returns the structured dtype of the current (Current_date) or history (Cob_date) dataset
+    """
+    return [("Primary_key", "i8")] + [(x, attribute_type) for x in attributes] + \
+        [(date_column, "S10")]
+
+def filter_shard(chunk, shard):
+    """
+    Returns the rows of the chunk in the [index, shards] shard, the Primary_key values whose
+    modulo shards is index like the spark pmod, all the rows without a shard. The history rows
+    of the other shards never match the current keys and are not kept either.
+    """
+    if not shard:
+        return chunk
+    index, shards = shard
+    return chunk[np.mod(chunk["Primary_key"], shards) == index]
+
+def get_window_start(keys, key_index, current_days, since=None, lookback_days=None):
+    """
+    Returns the earliest history day number considered for each key, from the since date and
+    from lookback_days before the earliest Current_date of the key, None without a window.
+    Like the spark engine, the later Current_dates of a repeated key share that wider window.
+    """
+    if not since and lookback_days is None:
+        return None
+    window_start = np.full(len(keys), np.iinfo(np.int64).min, dtype=np.int64)
+    if lookback_days is not None:
+        # Keys without a Current_date keep their whole history like with the spark engine
+        key_days = np.full(len(keys), NO_DATE, dtype=np.int64)
+        np.minimum.at(key_days, key_index, current_days)
+        window_start = np.where(key_days == NO_DATE, window_start, key_days - lookback_days)
+    if since:
+        window_start = np.maximum(window_start,
+            (date.fromisoformat(since) - date(1970, 1, 1)).days)
+    return window_start
+
+def get_first_yes(keys, dataset2_path, scan, workers=None):
+    """
+    Streams the history dataset and returns the earliest Yes day number of each attribute for
+    the provided sorted keys along with the keys found in the history and the history row count.
+    History rows before the window start day number of their key are skipped. The files of a
+    multi-file history are reduced in parallel by worker processes and their minimums merged.
+    """
+    input_files = get_input_files(dataset2_path)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(input_files)))
+    tasks = [(keys, input_files[index::workers], scan) for index in range(workers)]
+    if workers == 1:
+        return reduce_history(*tasks[0])
+    with multiprocessing.Pool(workers) as pool:
+        shards = pool.starmap(reduce_history, tasks)
+    return np.minimum.reduce([x[0] for x in shards]), \
+        np.logical_or.reduce([x[1] for x in shards]), sum(x[2] for x in shards)
+
+def reduce_history(keys, input_files, scan):
+    """
+    Returns the earliest Yes day number of each attribute for the sorted keys, the keys found
+    and the row count of the history csv files
+    """
+    first_yes = np.full((len(scan.attributes), len(keys)), NO_DATE, dtype=np.int64)
+    seen = np.zeros(len(keys), dtype=bool)
+    history_rows = 0
+    history_dtype = get_dtype("Cob_date", scan.attributes, "S4")
+    for chunk in itertools.chain.from_iterable(
+        read_csv_chunks(x, history_dtype, scan.chunk_rows, scan.file_date) for x in input_files):
+        history_rows += len(chunk)
+        index, match, cob_days = match_history(keys, chunk, scan.window_start)
+        seen[index[match]] = True
+        for attribute_index, attribute in enumerate(scan.attributes):
+            yes = match & (chunk[attribute] == b"Yes") & (cob_days != NO_DATE)
+            np.minimum.at(first_yes[attribute_index], index[yes], cob_days[yes])
+    return first_yes, seen, history_rows
+
+def match_history(keys, chunk, window_start=None):
+    """
+    Returns the index of the sorted keys of each history row of the chunk, whether the row
+    matches a key and is within the window of the key, and the Cob_date day numbers
+    """
+    index = np.searchsorted(keys, chunk["Primary_key"])
+    index[index == len(keys)] = 0
+    match = keys[index] == chunk["Primary_key"] if len(keys) else np.zeros(len(chunk), bool)
+    cob_days = parse_dates(chunk["Cob_date"])
+    if window_start is not None:
+        match &= (cob_days >= window_start[index]) & (cob_days != NO_DATE)
+    return index, match, cob_days
+
+def get_index(index_path):
+    """
+    Returns the manifest of a history index directory or None when the path is not an index
+    """
+    manifest_path = os.path.join(index_path, INDEX_FILE)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf8") as manifest_file:
+        return json.load(manifest_file)
+
+def index_file(attribute):
+    """
+    Returns the index file name of the earliest Yes day numbers of the attribute
+    """
+    return f"first_yes_{attribute.lower()}.npy"
+
+def get_fingerprint(source_path):
+    """
+    Returns the fingerprint of a history source file from its size and a hash of its first and
+    last bytes, which changes when the file is rewritten or appended to
+    """
+    size = os.path.getsize(source_path)
+    checksum = hashlib.blake2b(str(size).encode("utf8"), digest_size=16)
+    with open(source_path, "rb") as source_file:
+        checksum.update(source_file.read(FINGERPRINT_BYTES))
+        source_file.seek(max(size - FINGERPRINT_BYTES, 0))
+        checksum.update(source_file.read(FINGERPRINT_BYTES))
+    return checksum.hexdigest()
+
+def validate_index(index_path, attributes):
+    """
+    Returns the index manifest after checking it holds the attributes and that the source files
+    it was built from, where they still exist, did not change since
+    """
+    manifest = get_index(index_path)
+    missing = [x for x in attributes if x not in manifest["attributes"]]
+    if missing:
+        logger.info("history index has no first Yes days for %s - %s", missing, index_path)
+        sys.exit(1)
+    for source in manifest["sources"]:
+        if os.path.isfile(source["path"]) and \
+            get_fingerprint(source["path"]) != source["fingerprint"]:
+            logger.info("history index is stale, %s changed since it was indexed and the index "
+                "is required to be rebuilt - %s", source["path"], index_path)
+            sys.exit(1)
+    return manifest
+
+def get_indexed_first_yes(keys, index_path, attributes):
+    """
+    Looks the provided sorted keys up in the memory mapped history index and returns the same
+    earliest Yes day numbers, found keys and history row count as the streamed history, only
+    the index pages of the looked up keys are read
+    """
+    manifest = validate_index(index_path, attributes)
+    index_keys = np.load(os.path.join(index_path, INDEX_KEYS_FILE), mmap_mode="r")
+    index = np.searchsorted(index_keys, keys)
+    index[index == len(index_keys)] = 0
+    seen = index_keys[index] == keys if len(index_keys) else np.zeros(len(keys), bool)
+    first_yes = np.full((len(attributes), len(keys)), NO_DATE, dtype=np.int64)
+    for attribute_index, attribute in enumerate(attributes):
+        index_days = np.load(os.path.join(index_path, index_file(attribute)), mmap_mode="r")
+        days = index_days[index[seen]].astype(np.int64)
+        first_yes[attribute_index][seen] = np.where(days == NO_INDEX_DATE, NO_DATE, days)
+    return first_yes, seen, manifest["rows"]
+
+def read_csv_chunks(dataset_path, dtype, chunk_rows, file_date="No"):
+    """
+    Yields structured arrays of up to chunk_rows rows of the csv files of the path, the header
+    of each file is skipped and the columns are taken by position. Rows with a missing, malformed
+    or out of range key are dropped. With file_date the date column is the date of the file name.
+    """
+    for file_path in get_input_files(dataset_path):
+        date_value = get_file_date(file_path) if file_date == "Yes" else None
+        with open_input_file(file_path) as dataset_file:
+            next(dataset_file, None)
+            while True:
+                lines = list(itertools.islice(dataset_file, chunk_rows))
+                if not lines:
+                    break
+                try:
+                    chunk = np.loadtxt(lines, dtype=dtype, delimiter=",", comments=None,
+                        quotechar='"', ndmin=1)
+                except ValueError:
+                    chunk = parse_lines(lines, dtype)
+                chunk = chunk[(chunk["Primary_key"] >= MIN_KEY) & (chunk["Primary_key"] <= MAX_KEY)]
+                if date_value is not None:
+                    chunk[dtype[-1][0]] = date_value
+                yield chunk
+
+def get_input_files(dataset_path):
+    """
+    Returns the sorted data files of a file, directory or glob pattern path, the files and
+    directories starting with _ or . are skipped like spark does
+    """
+    input_files = []
+    paths = [dataset_path] if os.path.exists(dataset_path) else glob.glob(dataset_path)
+    for path in paths:
+        if not os.path.isdir(path):
+            input_files.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [x for x in dirs if not x.startswith(("_", "."))]
+            input_files += [os.path.join(root, x) for x in files if not x.startswith(("_", "."))]
+    return sorted(input_files)
+
+def open_input_file(file_path):
+    """
+    Opens the csv file as text, decompressing gzip and bz2 files from their extension
+    """
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(file_path)[1].lower(), open)
+    return opener(file_path, "rt", encoding="utf8")
+
+def get_file_date(file_path):
+    """
+    Returns the MM/dd/yyyy date of the file name, empty when the name holds no date
+    """
+    match = re.search(FILE_DATE_PATTERN, file_path.replace(os.sep, "/"))
+    if match is None:
+        return b""
+    return f"{match.group(2)}/{match.group(3)}/{match.group(1)}".encode("utf8")
+
+def parse_lines(lines, dtype):
+    """
+    Slow path parsing the csv lines one by one when a chunk holds malformed rows
+    """
+    rows = []
+    for line in lines:
+        values = line.rstrip("\r\n").split(",")
+        if len(values) != len(dtype):
+            continue
+        try:
+            values[0] = int(values[0])
+        except ValueError:
+            continue
+        if not MIN_KEY <= values[0] <= MAX_KEY:
+            continue
+        rows.append(tuple(values))
+    return np.array(rows, dtype=dtype)
+
+def parse_dates(values):
+    """
+    Returns the day numbers since 1970-01-01 of the MM/dd/yyyy byte strings,
+    malformed dates are returned as NO_DATE
+    """
+    digits = np.frombuffer(np.ascontiguousarray(values, dtype="S10").tobytes(),
+        dtype=np.uint8).reshape(-1, 10).astype(np.int64) - ord("0")
+    valid = (
+        np.all((digits[:, [0, 1, 3, 4, 6, 7, 8, 9]] >= 0) &
+            (digits[:, [0, 1, 3, 4, 6, 7, 8, 9]] <= 9), axis=1) &
+        (digits[:, 2] == ord("/") - ord("0")) & (digits[:, 5] == ord("/") - ord("0"))
+    )
+    month = digits[:, 0] * 10 + digits[:, 1]
+    day = digits[:, 3] * 10 + digits[:, 4]
+    year = digits[:, 6] * 1000 + digits[:, 7] * 100 + digits[:, 8] * 10 + digits[:, 9]
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month(year, month))
+
+    # Days from civil date algorithm on a calendar starting in March
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return np.where(valid, era * 146097 + day_of_era - EPOCH_SHIFT, NO_DATE)
+
+def days_in_month(year, month):
+    """
+    Returns the number of days of the month for the arrays of years and months
+    """
+    leap = ((year % 4 == 0) & (year % 100 != 0)) | (year % 400 == 0)
+    days = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])[np.clip(month, 1, 12) - 1]
+    return days + ((month == 2) & leap)
+
+def format_date(day_number):
+    """
+    Returns the MM/dd/yyyy string of a day number since 1970-01-01
+    """
+    if day_number == NO_DATE:
+        return ""
+    day = np.datetime64(int(day_number), "D").item()
+    return day.strftime("%m/%d/%Y")
+
+def csv_value(value):
+    """
+    Returns the value quoted the same way the spark csv writer does, empty values are read
+    as null by spark and written back empty
+    """
+    if any(x in value for x in (",", '"', "\n", "\r")):
+        return '"' + value.replace('"', '\\"') + '"'
+    return value
+
+def show_results(header, results, truncate):
+    """
+    Prints the first 20 results to the screen, truncating the values to 20 characters
+    """
+    width = 20 if truncate else None
+    logger.info("showing the first %s of %s results", min(20, len(results)), len(results))
+    print(",".join(header))
+    for result in results[:20]:
+        print(",".join(value[:width] for value in result))
@@ -0,0 +1,224 @@
+"""
+# Title : Code Assessment - Data Quality
+# Description : Checks the raw csv datasets and quarantines their invalid rows
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import os
+import logging
+from pyspark.sql.functions import when, date_format, max as spark_max, col, lit, coalesce
+from pyspark.sql.functions import min as spark_min, to_date, struct, count
+from pyspark.sql.functions import array_repeat, explode, sum as spark_sum
+import datasets
+
+logger = logging.getLogger()
+
+# Share of quarantined rows above which the data quality checks stop the run
+QUALITY_THRESHOLD = 0.01
+
+class QualityError(Exception):
+    """
+    Raised when the quarantined share of the rows is above the quality threshold
+    """
+
+def get_row_issue(dataset, date_column, attributes):
+    """
+    Returns the first data quality issue of the raw string columns of a row, null for a valid row
+    """
+    # The int cast alone accepts decimals and surrounding spaces, the key is required to be
+    # digits only and in the int range
+    key_valid = coalesce(dataset.Primary_key.rlike(r"^-?\d+$"), lit(False)) & \
+        dataset.Primary_key.cast("int").isNotNull()
+    issue = when(~key_valid, lit("invalid key")).when(
+        to_date(dataset[date_column], "MM/dd/yyyy").isNull(), lit("invalid date"))
+    for attribute in attributes:
+        issue = issue.when(~coalesce(dataset[attribute].isin("Yes", "No"), lit(False)),
+            lit(f"invalid {attribute}"))
+    return issue
+
+def get_quarantine_row(dataset, date_column, attributes, reason):
+    """
+    Returns the quarantine row struct of the raw string columns with the issue reason
+    """
+    return struct(
+        [reason.alias("Reason"), dataset.Primary_key] + [dataset[x] for x in attributes] +
+        [dataset[date_column].alias("Date")]
+    )
+
+def get_checked_history(history, attributes):
+    """
+    Reduces the raw history in its aggregation scan to the first Yes dates, the last Cob_date and
+    the row counts by key, with separate rows for the duplicated Cob_dates and the invalid rows
+    of a key. The rows are partitioned once by key then grouped by key and Cob_date, so that
+    duplicated dates are counted without collecting the dates of each key or a second shuffle.
+    """
+    issue = get_row_issue(history, "Cob_date", attributes)
+    valid = issue.isNull()
+    key_dates = (
+        history
+        .select([history.Primary_key.cast("int").alias("Primary_key"),
+            when(valid, to_date(history.Cob_date, "MM/dd/yyyy")).alias("Cob_date"),
+            when(~valid, get_quarantine_row(history, "Cob_date", attributes, issue)).alias(
+                "Invalid_row")] +
+            [(history[attribute]=="Yes").alias(attribute) for attribute in attributes])
+        .repartition("Primary_key")
+        .groupBy("Primary_key", "Cob_date", "Invalid_row")
+        .agg(*[spark_max(attribute).alias(attribute) for attribute in attributes],
+            count(lit(1)).alias("Rows"))
+    )
+    return (
+        key_dates
+        .groupBy(col("Primary_key"),
+            when(col("Rows") > 1, col("Cob_date")).alias("Duplicate_date"), col("Invalid_row"))
+        .agg(*[
+            spark_min(when(col(attribute), col("Cob_date"))).alias(
+                datasets.first_yes_column(attribute))
+            for attribute in attributes
+        ],
+            spark_max("Cob_date").alias("Last_cob_date"),
+            spark_sum("Rows").alias("History_rows"),
+            count("Cob_date").alias("Valid_dates")
+        )
+    )
+
+def check_quality(args, attributes, spark):
+    """
+    Checks the raw csv datasets in the same scan as the first Yes aggregation and returns the
+    valid current rows, the first Yes dates of the valid history rows and the persisted datasets
+    they are read from. Invalid rows, duplicated (Primary_key, Cob_date) pairs and current keys
+    with no history are written to the quarantine file and summarised in the logs, and the run
+    stops when the quarantined share of the rows exceeds the quality threshold with a
+    QualityError. The checked history is released once quarantined and counted, the persisted
+    datasets are unpersisted when the checks fail.
+    """
+    current = datasets.get_dataset(args["dataset1_path"],
+        datasets.get_raw_schema("Current_date", attributes), spark)
+    history = datasets.get_dataset(args["dataset2_path"],
+        datasets.get_raw_schema("Cob_date", attributes), spark)
+    if args.get("file_date", "No") == "Yes":
+        history = history.withColumn("Cob_date",
+            date_format(datasets.get_file_date(), "MM/dd/yyyy"))
+    current = current.withColumn("Issue",
+        get_row_issue(current, "Current_date", attributes)).persist()
+    checked = get_checked_history(history, attributes).persist()
+    valid_current = current.filter(col("Issue").isNull()).select(
+        [col("Primary_key").cast("int")] + attributes +
+        [to_date(col("Current_date"), "MM/dd/yyyy").alias("Current_date")])
+    # The first Yes dates are cached by the no history join of the quarantine export
+    first_yes = (
+        checked.filter(col("Valid_dates") > 0)
+        .groupBy("Primary_key")
+        .agg(*[spark_min(datasets.first_yes_column(x)).alias(datasets.first_yes_column(x))
+            for x in attributes], spark_max("Last_cob_date").alias("Last_cob_date"))
+        .persist()
+    )
+    try:
+        no_history = valid_current.join(first_yes, "Primary_key", how='left_anti')
+        quarantine_path = get_quarantine_path(args)
+        datasets.export_results(get_quarantine(current, checked, no_history, attributes),
+            quarantine_path, "csv")
+        check_threshold(*get_quality_counts(current, checked, no_history), quarantine_path,
+            args.get("quality_threshold", QUALITY_THRESHOLD))
+    except (Exception, SystemExit):
+        current.unpersist()
+        first_yes.unpersist()
+        raise
+    finally:
+        checked.unpersist()
+    return valid_current, first_yes, [current, first_yes]
+
+def check_threshold(issues, rows, quarantine_path, threshold):
+    """
+    Logs the quarantined row counts and raises a QualityError when their share of the rows is
+    above the threshold
+    """
+    issue_rows = sum(issues.values())
+    for (dataset, reason), issue_count in sorted(issues.items()):
+        logger.info("data quality - %s - %s - %s rows", dataset, reason, issue_count)
+    logger.info("data quality - %s of %s rows quarantined to %s", issue_rows, rows,
+        quarantine_path)
+    if rows and issue_rows / rows > threshold:
+        raise QualityError(f"quarantined share of {issue_rows} of {rows} rows above the "
+            f"{threshold} threshold - {quarantine_path}")
+
+def validate_quality(args):
+    """
+    Returns True once logged when the quality checks are requested with options they do not
+    support
+    """
+    unsupported = [args.engine != "spark", args.plan != "aggregate",
+        args.input_format not in ["auto", "csv"], args.state_path is not None,
+        args.backfill_from is not None, args.since is not None, args.lookback_days is not None]
+    if args.quality == "Yes" and any(unsupported):
+        logger.info("quality checks are only supported for csv datasets by the spark engine "
+            "aggregate plan without state_path, backfill, since or lookback_days")
+        return True
+    return False
+
+def get_quarantine_path(args):
+    """
+    Returns the quarantine file path of the quality checks, next to the result by default
+    """
+    return args.get("quarantine_path") or \
+        os.path.splitext(args["result_path"])[0] + "_quarantine.csv"
+
+def get_quarantine(current, checked, no_history, attributes):
+    """
+    Returns the quarantine rows of the checked datasets, the invalid current rows, the current
+    keys with no history, the invalid history rows and the extra rows of the duplicated
+    (Primary_key, Cob_date) pairs
+    """
+    empty_attributes = [lit(None).cast("string").alias(x) for x in attributes]
+    return (
+        current.filter(col("Issue").isNotNull())
+        .select([lit("current").alias("Dataset"), col("Issue").alias("Reason"),
+            col("Primary_key")] + attributes + [col("Current_date").alias("Date")])
+        .unionByName(
+            no_history
+            .select([lit("current").alias("Dataset"), lit("no history").alias("Reason"),
+                col("Primary_key").cast("string")] + attributes +
+                [date_format(col("Current_date"), "MM/dd/yyyy").alias("Date")]))
+        .unionByName(
+            checked.filter(col("Invalid_row").isNotNull())
+            .select(explode(array_repeat(col("Invalid_row"), col("History_rows").cast("int")))
+                .alias("Row"))
+            .select([lit("history").alias("Dataset"), col("Row.*")]))
+        .unionByName(
+            checked.filter(col("Duplicate_date").isNotNull())
+            .select(col("Primary_key"), explode(array_repeat(col("Duplicate_date"),
+                (col("History_rows") - 1).cast("int"))).alias("Day"))
+            .select([lit("history").alias("Dataset"), lit("duplicate key date").alias("Reason"),
+                col("Primary_key").cast("string")] + empty_attributes +
+                [date_format(col("Day"), "MM/dd/yyyy").alias("Date")]))
+    )
+
+def get_quality_counts(current, checked, no_history):
+    """
+    Returns the quarantined row counts by (Dataset, Reason) and the total row count of both
+    datasets, aggregated from the persisted checked datasets
+    """
+    issues = {}
+    rows = 0
+    for issue in current.groupBy("Issue").count().collect():
+        rows += issue["count"]
+        if issue["Issue"] is not None:
+            issues[("current", issue["Issue"])] = issue["count"]
+    invalid = col("Invalid_row").isNotNull()
+    duplicate = col("Duplicate_date").isNotNull()
+    for issue in (
+        checked
+        .groupBy(when(invalid, col("Invalid_row.Reason")).when(duplicate,
+            lit("duplicate key date")).alias("Reason"))
+        .agg(spark_sum("History_rows").alias("Rows"), spark_sum(when(invalid,
+            col("History_rows")).when(duplicate, col("History_rows") - 1)).alias("Issue_rows"))
+        .collect()
+    ):
+        rows += issue["Rows"]
+        if issue["Reason"] is not None:
+            issues[("history", issue["Reason"])] = issue["Issue_rows"]
+    no_history_rows = no_history.count()
+    if no_history_rows:
+        issues[("current", "no history")] = no_history_rows
+    return issues, rows
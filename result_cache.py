@@ -0,0 +1,178 @@
+"""
+# Title : Code Assessment - Result Cache
+# Description : Reuses the result of a previous creator run with the same inputs and options
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger()
+
+CACHE_MB = 1024
+ENTRY_FILE = "entry.json"
+# Modules whose code computes the results, a change of their code changes every cache key
+CODE_FILES = ["creator.py", "numpy_engine.py", "datasets.py", "quality.py", "backfill.py",
+    "bucketing.py"]
+# Bytes hashed at both ends of each input file by the sample hash
+SAMPLE_BYTES = 1 << 20
+# Arguments that are not part of the result or that are the cache settings themselves
+IGNORED_OPTIONS = ["result_path", "show", "metrics_path", "profile_path", "cache_dir",
+    "cache_mb", "cache_hash"]
+INPUT_OPTIONS = ["dataset1_path", "dataset2_path", "previous_result_path", "spark_config_path"]
+
+def get_key(args):
+    """
+    Returns the cache key of the run from the fingerprints of its input paths, its options and
+    the code computing the results, None when the run is not cacheable: the state snapshot
+    mode updates its snapshot and the show option prints the result
+    """
+    if args.get("state_path") or args.get("show", "No") != "No":
+        return None
+    hash_mode = args.get("cache_hash", "sample")
+    key = {
+        "options": {x: y for x, y in args.items()
+            if x not in IGNORED_OPTIONS and x not in INPUT_OPTIONS},
+        "inputs": {x: get_fingerprint(args[x], hash_mode) for x in INPUT_OPTIONS if args.get(x)},
+        "code": get_code_version()
+    }
+    return hashlib.blake2b(json.dumps(key, sort_keys=True, default=str).encode("utf8"),
+        digest_size=16).hexdigest()
+
+def get_code_version():
+    """
+    Returns the hash of the code files computing the results
+    """
+    checksum = hashlib.blake2b(digest_size=16)
+    for code_file in CODE_FILES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), code_file),
+            "rb") as source_file:
+            checksum.update(source_file.read())
+    return checksum.hexdigest()
+
+def get_fingerprint(path, hash_mode="sample"):
+    """
+    Returns the size and modification time of the file or of each file of the directory or glob
+    pattern, with a hash of their first and last bytes (sample), of their whole content (full)
+    or none
+    """
+    if not os.path.exists(path):
+        return [[x] + get_fingerprint(x, hash_mode) for x in sorted(glob.glob(path))]
+    if os.path.isdir(path):
+        return [
+            [os.path.relpath(os.path.join(root, x), path)] +
+                get_fingerprint(os.path.join(root, x), hash_mode)
+            for root, _, files in sorted(os.walk(path)) for x in sorted(files)
+        ]
+    stat = os.stat(path)
+    fingerprint = [stat.st_size, stat.st_mtime_ns]
+    if hash_mode == "none":
+        return fingerprint
+    checksum = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as input_file:
+        if hash_mode == "full":
+            for chunk in iter(lambda: input_file.read(1 << 20), b""):
+                checksum.update(chunk)
+        else:
+            checksum.update(input_file.read(SAMPLE_BYTES))
+            input_file.seek(max(stat.st_size - SAMPLE_BYTES, 0))
+            checksum.update(input_file.read(SAMPLE_BYTES))
+    return fingerprint + [checksum.hexdigest()]
+
+def restore(cache_dir, key, output_paths):
+    """
+    Copies the cached outputs of the key to their output paths, output_paths maps the output
+    names to their paths, and returns whether the key was found with every output. The entry is
+    marked as the most recently used.
+    """
+    entry_path = os.path.join(cache_dir, key)
+    if not os.path.isfile(os.path.join(entry_path, ENTRY_FILE)) or not all(
+        os.path.exists(os.path.join(entry_path, x)) for x in output_paths):
+        return False
+    for name, output_path in output_paths.items():
+        remove_path(output_path)
+        copy_path(os.path.join(entry_path, name), output_path)
+    os.utime(os.path.join(entry_path, ENTRY_FILE))
+    logger.info("result restored from cache - %s - %s", entry_path, output_paths)
+    return True
+
+def store(cache_dir, key, output_paths, cache_mb=CACHE_MB):
+    """
+    Copies the outputs to a new cache entry of the key then evicts the least recently used
+    entries beyond cache_mb megabytes. The outputs are copied rather than linked so that later
+    edits of the outputs do not change the cached copies. Outputs larger than cache_mb megabytes
+    on their own are not copied as they would be evicted straight away.
+    """
+    if not all(os.path.exists(x) for x in output_paths.values()):
+        return
+    output_bytes = sum(get_size(x) for x in output_paths.values())
+    if output_bytes > cache_mb * 1024 * 1024:
+        logger.info("result not cached, %s bytes above the %s MB cache size - %s", output_bytes,
+            cache_mb, key)
+        if os.path.isdir(cache_dir):
+            evict(cache_dir, cache_mb)
+        return
+    entry_path = os.path.join(cache_dir, key)
+    new_entry_path = f"{entry_path}.{os.getpid()}.new"
+    remove_path(new_entry_path)
+    os.makedirs(new_entry_path)
+    for name, output_path in output_paths.items():
+        copy_path(output_path, os.path.join(new_entry_path, name))
+    with open(os.path.join(new_entry_path, ENTRY_FILE), "w", encoding="utf8") as entry_file:
+        json.dump({"created": time.time(), "bytes": output_bytes}, entry_file)
+    remove_path(entry_path)
+    os.rename(new_entry_path, entry_path)
+    evict(cache_dir, cache_mb)
+
+def evict(cache_dir, cache_mb=CACHE_MB):
+    """
+    Removes the least recently used entries until the cache fits in cache_mb megabytes
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry_file_path = os.path.join(cache_dir, name, ENTRY_FILE)
+        if os.path.isfile(entry_file_path):
+            with open(entry_file_path, encoding="utf8") as entry_file:
+                entries.append((os.path.getmtime(entry_file_path), json.load(entry_file)["bytes"],
+                    name))
+    total_bytes = sum(x[1] for x in entries)
+    for _, entry_bytes, name in sorted(entries):
+        if total_bytes <= cache_mb * 1024 * 1024:
+            break
+        remove_path(os.path.join(cache_dir, name))
+        total_bytes -= entry_bytes
+        logger.info("result cache entry evicted - %s", name)
+
+def copy_path(source_path, target_path):
+    """
+    Copies the file or the files of the directory
+    """
+    if os.path.isdir(source_path):
+        shutil.copytree(source_path, target_path)
+    else:
+        shutil.copy2(source_path, target_path)
+
+def remove_path(path):
+    """
+    Removes the file or directory when it exists
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def get_size(path):
+    """
+    Returns the size of the file or of the files of the directory
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, x))
+            for root, _, files in os.walk(path) for x in files)
+    return os.path.getsize(path)
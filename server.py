@@ -0,0 +1,129 @@
+"""
+# Title : Code Assessment - Job Server
+# Description : Long lived local server running creator jobs on a warm spark session
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import textwrap
+import sys
+import argparse
+import json
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from pyspark.sql import SparkSession
+import creator
+from creator import logger
+
+def parse_input():
+    """
+    Parse script arguments
+    """
+    parser =  argparse.ArgumentParser(
+        prog=sys.argv[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+example:
+    # Start the server on the default localhost port
+    python3 ./server.py
+
+    # Submit a job with the creator.py long options or the creator.main argument names as
+    # json keys, the response is sent once the job is done
+    curl -X POST localhost:8765/jobs -d '{"dataset1_path": "dataset1.csv",
+        "dataset2_path": "dataset2.csv", "result_path": "results.csv", "plan": "aggregate"}'
+
+    # Server status with the number and the input file size of the cached datasets
+    curl localhost:8765/status
+    ''')
+    )
+
+    parser.add_argument("-p","--port", help="Localhost port to listen on",
+        type=int, default=8765, required=False)
+    args = parser.parse_args()
+    return args
+
+class JobHandler(BaseHTTPRequestHandler):
+    """
+    Runs the posted creator jobs one at a time with the server dataset cache
+    """
+    dataset_cache = {}
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """
+        Returns the server status with the number of cached datasets and their input file size
+        """
+        if self.path != "/status":
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        self.send_json(200, {
+            "status": "ready",
+            "cached_datasets": len(self.dataset_cache),
+            "max_cached_datasets": creator.DATASET_CACHE_ENTRIES,
+            "cached_input_bytes": sum(x[2] for version, _ in self.dataset_cache.values()
+                for x in version)
+        })
+
+    def do_POST(self): # pylint: disable=invalid-name
+        """
+        Validates the job parameters like the command line ones and runs the job
+        """
+        if self.path != "/jobs":
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            argv = []
+            for name, value in job.items():
+                argv += [f"--{creator.ARGUMENT_OPTIONS.get(name, name)}",
+                    ",".join(value) if isinstance(value, list) else str(value)]
+            args = creator.validate_args(creator.parse_input(argv))
+        except (ValueError, AttributeError, SystemExit) as err:
+            self.send_json(400, {"error": f"invalid job parameters - {err}"})
+            return
+
+        start_time = time.perf_counter()
+        try:
+            creator.main(args, self.dataset_cache)
+        except (Exception, SystemExit) as err: # pylint: disable=broad-except
+            logger.exception("job failure - %s", err)
+            self.send_json(500, {"error": f"job failure - {err}"})
+            return
+        self.send_json(200, {
+            "status": "done",
+            "result_path": args["result_path"],
+            "seconds": round(time.perf_counter() - start_time, 3)
+        })
+
+    def send_json(self, status, body):
+        """
+        Sends the json response
+        """
+        content = json.dumps(body).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+def serve(port):
+    """
+    Starts the spark session then serves the jobs on localhost until interrupted
+    """
+    try:
+        SparkSession.builder.appName("DataSetCompare").getOrCreate()
+    except Exception as err: # pylint: disable=broad-except
+        logger.exception("spark session failure - %s", err)
+        sys.exit()
+    server = HTTPServer(("127.0.0.1", port), JobHandler)
+    logger.info("job server listening on 127.0.0.1:%s", port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("job server stopped")
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    serve(parse_input().port)
+    sys.exit()
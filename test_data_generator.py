@@ -8,11 +8,33 @@
 """
 
 import csv
+import json
 from datetime import datetime,timedelta
 import os
+import sys
+import argparse
+import textwrap
+import random
+import shutil
+import multiprocessing
+from collections import namedtuple
 
 MAX_CURRENT=300000
 MAX_HISTORY=25000000
+DAYS=84
+
+# Random and skewed distributions: probability of a Yes for each attribute of a history row
+# and for skewed keys the share of hot keys present every day, the others being present on a
+# day with the cold key probability
+YES_RATE=0.05
+HOT_KEYS=0.1
+COLD_KEY_RATE=0.1
+
+# Volume data set parameters, the data folder defaults to the dynamic data test folder and the
+# workers to the number of cpus
+VolumeParams = namedtuple("VolumeParams",
+    ["name", "current", "days", "data_folder", "workers", "distribution", "seed"],
+    defaults=[MAX_CURRENT, DAYS, None, None, "pattern", 0])
 
 
 CURRENT_HEADER=[
@@ -30,6 +52,7 @@ TEST_BASE_FOLDER =  os.path.join(os.getcwd(),"tests")
 TEST_DATA_IN1 = "input1.csv"
 TEST_DATA_IN2 = "input2.csv"
 TEST_DATA_OUT = "expected.csv"
+TEST_OPTIONS = "options.json"
 
 def generate_folder_structure():
     """
@@ -199,16 +222,108 @@ def generate_min_mid_max():
     dict_to_csv(os.path.join(test_folder,TEST_DATA_IN2),data2,HISTORY_HEADER)
     dict_to_csv(os.path.join(test_folder,TEST_DATA_OUT),data3,RESULT_HEADER)
 
-
-def generate_current(test_name):
+def generate_many_attributes():
     """
-    Generate current input file and expected results for Volume Test
+    Generate Data sets with a configured set of four attributes where:
+    key1
+     - Flag_1: Yes on MIN(date)
+     - Flag_2: Never Yes
+     - Flag_3: Yes on MAX(date) - current
+     - Flag_4: Always Yes
+    key2
+     - Flag_1: Never Yes
+     - Flag_2: Yes on MID(date)
+     - Flag_3: Yes on MIN(date)
+     - Flag_4: Never Yes
     """
-    today = datetime.today().strftime('%m/%d/%Y')
-    test_folder=os.path.join(TEST_BASE_FOLDER,"dynamic-data",test_name)
+    test_name="many_attributes"
+    attributes=["Flag_1","Flag_2","Flag_3","Flag_4"]
+    current_header=["Primary_key"] + attributes + ["Current_date"]
+    history_header=["Primary_key"] + attributes + ["Cob_date"]
+    result_header=current_header + [f"Days_since_{x.lower()}" for x in attributes]
+    flags={
+        1: {"01/01/2021": "YNNY", "01/02/2021": "NNNY", "01/03/2021": "NNYY"},
+        2: {"01/01/2021": "NNYN", "01/02/2021": "NYNN", "01/03/2021": "NNNN"},
+    }
+    days_since={1: [2,0,0,2], 2: [0,1,2,0]}
+
+    def row(key, cob_date, date_column):
+        data={"Primary_key": key, date_column: cob_date}
+        for attribute, flag in zip(attributes, flags[key][cob_date]):
+            data[attribute]="Yes" if flag == "Y" else "No"
+        return data
+
+    data1=[row(key,"01/03/2021","Current_date") for key in flags]
+    data2=[row(key,cob_date,"Cob_date") for cob_date in flags[1] for key in flags]
+    data3=[
+        dict(row(key,"01/03/2021","Current_date"),
+            **dict(zip(result_header[len(current_header):],days_since[key])))
+        for key in flags
+    ]
+
+    test_folder=os.path.join(TEST_BASE_FOLDER,"simple-data",test_name)
     if not os.path.exists(test_folder):
         os.mkdir(test_folder)
 
+    dict_to_csv(os.path.join(test_folder,TEST_DATA_IN1),data1,current_header)
+    dict_to_csv(os.path.join(test_folder,TEST_DATA_IN2),data2,history_header)
+    dict_to_csv(os.path.join(test_folder,TEST_DATA_OUT),data3,result_header)
+    with open(os.path.join(test_folder,TEST_OPTIONS),"w",encoding="utf8") as options_file:
+        json.dump({"attributes": attributes}, options_file)
+
+def parse_input():
+    """
+    Parse script arguments
+    """
+    parser =  argparse.ArgumentParser(
+        prog=sys.argv[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+example:
+    # Generate the simple data sets and the 300000 keys by 85 days volume data set
+    python3 ./test_data_generator.py
+
+    # Generate a 1000000 keys by 100 days volume data set on 8 worker processes
+    python3 ./test_data_generator.py --name large --current 1000000 --days 99 --workers 8
+
+    # Generate a seeded skewed volume data set with a parquet copy of the history
+    python3 ./test_data_generator.py --name skewed --distribution skewed --seed 7 --format parquet
+    ''')
+    )
+
+    parser.add_argument("-n","--name", help="Volume data set name",
+        default="max_history", required=False)
+    parser.add_argument("-c","--current", help="Number of current keys",
+        type=int, default=MAX_CURRENT, required=False)
+    parser.add_argument("-d","--days", help="Number of history days before the current date",
+        type=int, default=DAYS, required=False)
+    parser.add_argument("-H","--history", help="Approximate number of history rows, sets the "
+        "number of days from the number of current keys", type=int, default=None, required=False)
+    parser.add_argument("-w","--workers", help="Number of worker processes",
+        type=int, default=os.cpu_count(), required=False)
+    parser.add_argument("-D","--distribution", help="History distribution, pattern follows the "
+        "documented key ranges, random draws seeded Yes flags and skewed also draws the days "
+        "each key is present with hot and cold keys",
+        choices = ["pattern", "random", "skewed"], default="pattern", required=False)
+    parser.add_argument("-s","--seed", help="Seed of the random and skewed distributions",
+        type=int, default=0, required=False)
+    parser.add_argument("-f","--format", help="History output format, parquet also writes a "
+        "copy of the history partitioned by Cob_date", choices = ["csv", "parquet"],
+        default="csv", required=False)
+    parser.add_argument("--data_folder", help="Volume data sets folder",
+        default=os.path.join(TEST_BASE_FOLDER,"dynamic-data"), required=False)
+    args = parser.parse_args()
+    return args
+
+def generate_current(params,first_yes=None):
+    """
+    Generate current input file and expected results for Volume Test.
+    For the random and skewed distributions the expected results come from the first_yes
+    day offsets returned by generate_history
+    """
+    today = datetime.today().strftime('%m/%d/%Y')
+    test_folder = get_volume_folder(params)
+    rng = random.Random(f"{params.seed}-current")
     output_path = os.path.join(test_folder,TEST_DATA_IN1)
     expected_path = os.path.join(test_folder,TEST_DATA_OUT)
     with open(output_path,'w',encoding="utf8") as output_file,\
@@ -217,20 +332,39 @@ def generate_current(test_name):
         exp_writer = csv.writer(expected_file, quoting = csv.QUOTE_NONE, lineterminator='\n')
         out_writer.writerow(CURRENT_HEADER)
         exp_writer.writerow(RESULT_HEADER)
-        for i in range(1,MAX_CURRENT+1):
-            if 1 <= i <= 100000:
-                data_row=[i, 'No','No', 'Yes', today]
-                expected_row=[i, 'No','No', 'Yes', today,84,42,0]
-            if 100001 <= i <= 200000:
-                data_row=[i, 'No','Yes', 'No', today]
-                expected_row=[i, 'No','Yes', 'No', today,0,84,0]
-            if 200001 <= i <= 300000:
-                data_row=[i, 'No','Yes', 'Yes', today]
-                expected_row=[i, 'No','Yes', 'Yes', today,84,42,0]
+        for i in range(1,params.current+1):
+            if first_yes is None:
+                data_row, expected_row = get_pattern_current(i,params,today)
+            else:
+                data_row=[i]+[random_flag(rng) for _ in range(3)]+[today]
+                expected_row=None if first_yes[i-1] is None else \
+                    data_row+[max(x,0) for x in first_yes[i-1]]
             out_writer.writerow(data_row)
-            exp_writer.writerow(expected_row)
+            if expected_row is not None:
+                exp_writer.writerow(expected_row)
 
-def generate_history(test_name,days):
+def get_pattern_current(key,params,today):
+    """
+    Returns the current row and the expected result row of a key of the pattern distribution
+    """
+    mid = int(round(params.days/2,0))
+    if key <= params.current//3:
+        return [key, 'No','No', 'Yes', today], [key, 'No','No', 'Yes', today,params.days,mid,0]
+    if key <= 2*params.current//3:
+        return [key, 'No','Yes', 'No', today], [key, 'No','Yes', 'No', today,0,params.days,0]
+    return [key, 'No','Yes', 'Yes', today], [key, 'No','Yes', 'Yes', today,params.days,mid,0]
+
+def get_volume_folder(params):
+    """
+    Returns the folder of the volume data set, created when missing
+    """
+    test_folder=os.path.join(params.data_folder or os.path.join(TEST_BASE_FOLDER,"dynamic-data"),
+        params.name)
+    if not os.path.exists(test_folder):
+        os.makedirs(test_folder)
+    return test_folder
+
+def generate_history(params):
     """
     Generate Volume based Data sets where:
     300000 current records or keys
@@ -247,52 +381,172 @@ def generate_history(test_name,days):
      - a: Yes Before MID(date)
      - b: Yes ON or After MID(date)
      - c: Yes on MAX(date)
+    The key ranges are the thirds of the current keys.
+    The day range is sharded across worker processes writing chunk files that are then
+    stitched in day order. For the random and skewed distributions returns by key the
+    earliest Yes day offset of each attribute, -1 for never Yes, or None for keys with no history
     """
-    test_folder=os.path.join(TEST_BASE_FOLDER,"dynamic-data",test_name)
-    if not os.path.exists(test_folder):
-        os.mkdir(test_folder)
+    test_folder = get_volume_folder(params)
+    workers = max(1, min(params.workers or os.cpu_count() or 1, params.days + 1))
+    day_offsets = list(range(params.days,-1,-1))
+    shard_size = -(-len(day_offsets) // workers)
+    now = datetime.now()
+    tasks = [
+        (os.path.join(test_folder,f"{TEST_DATA_IN2}.part{index:04d}"),
+            day_offsets[start:start+shard_size], params, now)
+        for index, start in enumerate(range(0,len(day_offsets),shard_size))
+    ]
+    if workers == 1:
+        shards = [generate_history_shard(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            shards = pool.map(generate_history_shard, tasks)
 
     output_path = os.path.join(test_folder,TEST_DATA_IN2)
     with open(output_path,"w",encoding="utf8") as output_file:
-        writer = csv.writer(output_file,quoting = csv.QUOTE_NONE, lineterminator='\n')
-        writer.writerow(HISTORY_HEADER)
-        num_rows = 0
-        for day_offset in range(days,-1,-1):
-            historical_date=(datetime.now() - timedelta(day_offset)).strftime("%m/%d/%Y")
-            for i in range(1,MAX_CURRENT+1):
-                if 1 <= i <= 100000:
-                    attr_a = "Yes" if day_offset == days else "No"
-                    attr_b = "Yes" if day_offset == round(days/2,0) else "No"
-                    attr_c = "Yes" if day_offset == 0 else "No"
-                if 100001 <= i <= 200000:
-                    attr_a = "No"
-                    attr_b = "Yes"
-                    attr_c = "No"
-                if 200001 <= i <= 300000:
-                    attr_a = "Yes" if day_offset > round(days/2,0) else "No"
-                    attr_b = "Yes" if day_offset <= round(days/2,0) else "No"
-                    attr_c = "Yes" if day_offset == 0 else "No"
-                data_row=[i, attr_a, attr_b, attr_c, historical_date]
-                writer.writerow(data_row)
-                num_rows += 1
-
-    print(f"Created historical data file {test_name} with {num_rows} data rows.")
-
-# MAIN
-
-print("NEXT: Setup test folders")
-generate_folder_structure()
-
-print("NEXT: Setup sample data")
-generate_sample()
-generate_min_mid_max()
-
-print("NEXT: Setup volume data")
-start_time = datetime.now()
-print(f'StartTime {start_time}')
-generate_current("max_history")
-generate_history("max_history",84)
-time_elapsed = datetime.now() - start_time
-print(f"Time elapsed (hh:mm:ss.ms) {time_elapsed}")
-
-print("Done")
+        output_file.write(",".join(HISTORY_HEADER) + "\n")
+        for task in tasks:
+            with open(task[0],encoding="utf8") as chunk_file:
+                shutil.copyfileobj(chunk_file, output_file, 16 * 1024 * 1024)
+            os.remove(task[0])
+    num_rows = sum(x[0] for x in shards)
+    print(f"Created historical data file {params.name} with {num_rows} data rows.")
+
+    if params.distribution == "pattern":
+        return None
+    return merge_first_yes([x[1] for x in shards], params.current)
+
+def merge_first_yes(shards_first_yes, max_current):
+    """
+    Returns by key the earliest Yes day offsets of the shards
+    """
+    # Shards hold descending day offsets so the earliest Yes is the largest offset
+    first_yes = [None] * max_current
+    for shard_first_yes in shards_first_yes:
+        for i, key_first_yes in enumerate(shard_first_yes):
+            if key_first_yes is None:
+                continue
+            if first_yes[i] is None:
+                first_yes[i] = key_first_yes
+            else:
+                first_yes[i] = [max(x,y) for x,y in zip(first_yes[i],key_first_yes)]
+    return first_yes
+
+def generate_history_shard(task):
+    """
+    Writes the history rows of the shard day offsets to its chunk file in bulk, one day at a
+    time, and returns the number of rows with the earliest Yes day offsets of the shard
+    """
+    chunk_path, day_offsets, params, now = task
+    keys = [str(i) for i in range(1,params.current+1)]
+    first_yes = [None] * params.current if params.distribution != "pattern" else []
+    num_rows = 0
+    with open(chunk_path,"w",encoding="utf8") as chunk_file:
+        for day_offset in day_offsets:
+            historical_date=(now - timedelta(day_offset)).strftime("%m/%d/%Y")
+            if params.distribution == "pattern":
+                rows = get_pattern_rows(keys, day_offset, params.days, historical_date)
+            else:
+                rows = get_random_rows(keys, day_offset, params, historical_date, first_yes)
+            chunk_file.write("".join(rows))
+            num_rows += len(rows)
+    return num_rows, first_yes
+
+def get_pattern_rows(keys, day_offset, days, historical_date):
+    """
+    Returns the history rows of the day of the pattern distribution, one row by key
+    """
+    max_current = len(keys)
+    thirds = [(0,max_current//3), (max_current//3,2*max_current//3), (2*max_current//3,max_current)]
+    mid = round(days/2,0)
+    flags = [
+        ["Yes" if day_offset == days else "No",
+            "Yes" if day_offset == mid else "No",
+            "Yes" if day_offset == 0 else "No"],
+        ["No", "Yes", "No"],
+        ["Yes" if day_offset > mid else "No",
+            "Yes" if day_offset <= mid else "No",
+            "Yes" if day_offset == 0 else "No"]
+    ]
+    rows = []
+    for (start, end), third_flags in zip(thirds, flags):
+        suffix = f",{','.join(third_flags)},{historical_date}\n"
+        rows += [key + suffix for key in keys[start:end]]
+    return rows
+
+def get_random_rows(keys, day_offset, params, historical_date, first_yes):
+    """
+    Returns the history rows of the day of the random or skewed distribution seeded by day,
+    and records the day offset as the earliest Yes of the keys first Yes on that day so far
+    """
+    rng = random.Random(f"{params.seed}-{day_offset}")
+    rows = []
+    for i, key in enumerate(keys):
+        if params.distribution == "skewed" and i >= params.current * HOT_KEYS \
+            and rng.random() >= COLD_KEY_RATE:
+            continue
+        row_flags = [random_flag(rng) for _ in range(3)]
+        rows.append(f"{key},{','.join(row_flags)},{historical_date}\n")
+        if first_yes[i] is None:
+            first_yes[i] = [-1, -1, -1]
+        for attribute, flag in enumerate(row_flags):
+            if flag == "Yes" and first_yes[i][attribute] < day_offset:
+                first_yes[i][attribute] = day_offset
+    return rows
+
+def random_flag(rng):
+    """
+    Returns a seeded random Yes/No flag
+    """
+    return "Yes" if rng.random() < YES_RATE else "No"
+
+def validate_args(args):
+    """
+    Validates the input arguments and derives the number of days from the history rows
+    """
+    if args.current < 3 or args.days < 0 or args.workers < 1:
+        print("current is required to be at least 3, days positive and workers at least 1")
+        sys.exit(1)
+    days = args.days
+    if args.history is not None:
+        days = max(0, round(args.history / args.current) - 1)
+    return {
+        'volume': VolumeParams(args.name, args.current, days, args.data_folder, args.workers,
+            args.distribution, args.seed),
+        'format': args.format
+    }
+
+def main(args):
+    """
+    Generates the simple data sets and the volume data set
+    """
+    print("NEXT: Setup test folders")
+    generate_folder_structure()
+
+    print("NEXT: Setup sample data")
+    generate_sample()
+    generate_min_mid_max()
+    generate_many_attributes()
+
+    print("NEXT: Setup volume data")
+    start_time = datetime.now()
+    print(f'StartTime {start_time}')
+    first_yes = generate_history(args["volume"])
+    generate_current(args["volume"],first_yes)
+    if args["format"] == "parquet":
+        # Spark is only needed for the parquet copy of the history
+        import converter # pylint: disable=import-outside-toplevel
+        test_folder = get_volume_folder(args["volume"])
+        converter.convert({
+            'input_path': os.path.join(test_folder,TEST_DATA_IN2),
+            'output_path': os.path.join(test_folder,"input2.parquet"),
+            'dataset': 'history',
+            'format': 'parquet'
+        })
+    time_elapsed = datetime.now() - start_time
+    print(f"Time elapsed (hh:mm:ss.ms) {time_elapsed}")
+
+    print("Done")
+
+if __name__ == '__main__':
+    main(validate_args(parse_input()))
@@ -8,16 +8,37 @@
 import unittest
 import os
 import creator
+import converter
+import history_index
+import verifier
+import merger
+import metrics
 import hashlib
+import json
 import sys
+import tempfile
+import datetime
+import gzip
+import bz2
+import pstats
+import csv
+import subprocess
+import threading
+import shutil
+import urllib.request
+import server
+import datasets
+import quality
+from benchmarks import run as benchmarks_run
 
 TEST_ROOT = os.path.join(os.getcwd(),'tests')
 SIMPLE_DATA = os.path.join(TEST_ROOT,'simple-data')
 DYNAMIC_DATA = os.path.join(TEST_ROOT,'dynamic-data')
 
 class GeneralTestCase(unittest.TestCase):
-    def __init__(self, methodName, label=None, category=None):
+    def __init__(self, methodName, label=None, category=None, options=None):
         super(GeneralTestCase, self).__init__(methodName)
+        self.options = options or {}
         self.category = category
         if self.category == 'simple':
             self.test_folder = SIMPLE_DATA
@@ -39,28 +60,829 @@ class GeneralTestCase(unittest.TestCase):
             print(f"Error for {file_path} checksum generation - {err}")
             sys.exit(1)
         
-    def runTest(self):
-        print(self.label)
-        
-        dataset1_path = os.path.join(self.test_folder,self.label,'input1.csv')
-        dataset2_path = os.path.join(self.test_folder,self.label,'input2.csv')
-        result_path = os.path.join(self.test_folder,self.label,'result.csv')
-        expected_path = os.path.join(self.test_folder,self.label,'expected.csv')
-        
+    def test_options(self):
+        """
+        Returns the creator options of the test folder options.json file and of the test case
+        """
+        options = {}
+        options_path = os.path.join(self.test_folder,self.label,'options.json')
+        if os.path.exists(options_path):
+            with open(options_path) as options_file:
+                options.update(json.load(options_file))
+        options.update(self.options)
+        return options
+
+    def has_window(self):
+        """
+        Returns whether the test folder options truncate the history to a window
+        """
+        options = self.test_options()
+        return 'since' in options or 'lookback_days' in options
+
+    def data_path(self, file_name):
+        """
+        Returns the path of a file of the test folder
+        """
+        return os.path.join(self.test_folder,self.label,file_name)
+
+    def attributes(self):
+        """
+        Returns the attribute columns of the test datasets
+        """
+        return self.test_options().get('attributes', creator.ATTRIBUTES)
+
+    def test_param(self, **params):
+        """
+        Returns the creator arguments of the test folder datasets with the provided arguments and
+        the test options applied over them
+        """
         test_param = {
-            'dataset1_path': dataset1_path,
-            'dataset2_path': dataset2_path,
-            'result_path': result_path,
+            'dataset1_path': self.data_path('input1.csv'),
+            'dataset2_path': self.data_path('input2.csv'),
+            'result_path': self.data_path('result.csv'),
             'show': 'No'
         }
+        test_param.update(params)
+        test_param.update(self.test_options())
+        return test_param
+
+    def read_lines(self, file_name):
+        """
+        Returns the header and the non empty data lines of a csv file of the test folder
+        """
+        with open(self.data_path(file_name)) as csv_file:
+            header, *lines = [x.rstrip('\r\n') for x in csv_file.readlines() if x.strip()]
+        return header, lines
+
+    def write_lines(self, csv_path, lines, opener=open):
+        """
+        Writes the lines to a csv file
+        """
+        with opener(csv_path,'wt') as csv_file:
+            csv_file.write('\n'.join(lines) + '\n')
+
+    def assert_expected(self, result_path=None):
+        """
+        Asserts that the result file holds the expected result
+        """
+        with open(self.data_path('expected.csv')) as expected_file:
+            with open(result_path or self.data_path('result.csv')) as result_file:
+                self.assertEqual(expected_file.read(),result_file.read())
+
+    def assert_rejected(self, *argv):
+        """
+        Asserts that the creator command line arguments over the test folder datasets are
+        rejected by the argument validation
+        """
+        with self.assertRaises(SystemExit):
+            creator.validate_args(creator.parse_input(['-ds1',self.data_path('input1.csv'),
+                '-ds2',self.data_path('input2.csv'),'-r',self.data_path('result.csv')] +
+                list(argv)))
+
+    def runTest(self):
+        print(self.label, self.options)
+
+        test_param = self.test_param()
         creator.main(test_param)
-        if self.category == "simple":
-            with open(expected_path) as expected_file:
-                with open(result_path) as result_file:
-                    self.assertEqual(expected_file.read(),result_file.read())
+        if test_param.get('sort') == 'No':
+            # Unsorted results are compared regardless of the row order
+            self.assertEqual(verifier.compare(test_param['result_path'],
+                self.data_path('expected.csv')),[])
+        elif self.category == "simple":
+            self.assert_expected()
         else:
             # Due to volume comparison with the expected is done via checksum
-            self.assertEqual(self.md5(result_path),self.md5(expected_path))
+            self.assertEqual(self.md5(test_param['result_path']),
+                self.md5(self.data_path('expected.csv')))
+
+class IncrementalTestCase(GeneralTestCase):
+    """
+    Runs the simple datasets through the incremental mode, the state snapshot is built from the
+    history before the latest Cob_date then the latest Cob_date slice is folded into it and is
+    expected to give the expected result. The full history passed again is dated at or before
+    the watermark, its rows are expected to be logged as skipped and to leave the result
+    unchanged. A snapshot of other attributes and the legacy plan are expected to be rejected.
+    """
+    def runTest(self):
+        print(f"{self.label} incremental")
+
+        header, lines = self.read_lines('input2.csv')
+        dates = [datetime.datetime.strptime(x.split(',')[-1], '%m/%d/%Y') for x in lines]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            initial_path = os.path.join(tmp_dir,'initial.csv')
+            slice_path = os.path.join(tmp_dir,'slice.csv')
+            self.write_lines(initial_path,[header] + [x for x, y in zip(lines, dates)
+                if y < max(dates)])
+            self.write_lines(slice_path,[header] + [x for x, y in zip(lines, dates)
+                if y == max(dates)])
+            state_path = os.path.join(tmp_dir,'state')
+            creator.main(self.test_param(dataset2_path=initial_path,state_path=state_path))
+            creator.main(self.test_param(dataset2_path=slice_path,state_path=state_path))
+            self.assert_expected()
+            with self.assertLogs(level='INFO') as logs:
+                creator.main(self.test_param(state_path=state_path))
+            self.assertRegex('\n'.join(logs.output),
+                r'[1-9]\d* history rows dated at or before the watermark')
+            self.assert_expected()
+            with self.assertLogs(level='INFO') as logs:
+                with self.assertRaises(SystemExit):
+                    creator.main(dict(self.test_param(state_path=state_path),
+                        attributes=self.attributes()[:-1]))
+            self.assertIn('state snapshot columns','\n'.join(logs.output))
+            self.assert_rejected('--state_path',state_path,'--plan','legacy')
+
+class ColumnarTestCase(GeneralTestCase):
+    """
+    Runs the simple datasets with the history converted to parquet partitioned by Cob_date
+    """
+    encoding = 'strings'
+
+    def runTest(self):
+        print(f"{self.label} columnar {self.encoding}")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            parquet_path = os.path.join(tmp_dir,'input2.parquet')
+            converter.convert({
+                'input_path': self.data_path('input2.csv'),
+                'output_path': parquet_path,
+                'dataset': 'history',
+                'format': 'parquet',
+                'attributes': self.attributes(),
+                'encoding': self.encoding
+            })
+            creator.main(self.test_param(dataset2_path=parquet_path))
+            self.assert_expected()
+
+class OutputTestCase(GeneralTestCase):
+    """
+    Exports the simple datasets results as a multi-part csv directory and as parquet and orc
+    datasets, the part files and the datasets read back are expected to hold the expected rows
+    """
+    def runTest(self):
+        print(f"{self.label} output")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result_dir = os.path.join(tmp_dir,'result_dir')
+            creator.main(self.test_param(result_path=result_dir,output_layout='directory'))
+            self.assertEqual(verifier.compare(result_dir,self.data_path('expected.csv')),[])
+
+            spark = creator.get_spark_session('DataSetCompare', {})
+            for output_format in ['parquet','orc']:
+                result_path = os.path.join(tmp_dir,f'result.{output_format}')
+                creator.main(self.test_param(result_path=result_path,
+                    output_format=output_format))
+                csv_path = os.path.join(tmp_dir,f'{output_format}.csv')
+                datasets.export_results(spark.read.format(output_format).load(result_path)
+                    .orderBy('Primary_key'),csv_path,'csv')
+                self.assert_expected(csv_path)
+
+class EncodedTestCase(ColumnarTestCase):
+    """
+    Runs the simple datasets with the history converted to bitmask encoded parquet, more
+    attributes than the bitmask holds are expected to be refused
+    """
+    encoding = 'bitmask'
+
+    def runTest(self):
+        super().runTest()
+        with self.assertRaises(ValueError):
+            datasets.encode_attributes(None,
+                [f'Flag_{x}' for x in range(datasets.MAX_ENCODED_ATTRIBUTES + 1)])
+
+class BucketedTestCase(GeneralTestCase):
+    """
+    Runs the simple datasets converted to parquet bucketed by Primary_key, the history being
+    written in two slices with the second one appended into the same buckets. The plan of the
+    join and aggregation is expected to have no Primary_key exchange.
+    """
+    def runTest(self):
+        print(f"{self.label} bucketed")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            header, lines = self.read_lines('input2.csv')
+            slices = [lines[:len(lines) // 2], lines[len(lines) // 2:]]
+            history_path = os.path.join(tmp_dir,'input2.parquet')
+            current_path = os.path.join(tmp_dir,'input1.parquet')
+            for index, slice_lines in enumerate(slices):
+                slice_path = os.path.join(tmp_dir,f'slice{index}.csv')
+                self.write_lines(slice_path,[header] + slice_lines)
+                converter.convert({
+                    'input_path': slice_path,
+                    'output_path': history_path,
+                    'dataset': 'history',
+                    'format': 'parquet',
+                    'attributes': self.attributes(),
+                    'layout': 'bucketed',
+                    'buckets': 4,
+                    'mode': 'append' if index else 'overwrite'
+                })
+            converter.convert({
+                'input_path': self.data_path('input1.csv'),
+                'output_path': current_path,
+                'dataset': 'current',
+                'format': 'parquet',
+                'attributes': self.attributes(),
+                'layout': 'bucketed',
+                'buckets': 4
+            })
+            # The broadcast join is disabled so that the join runs on the buckets
+            spark_config_path = os.path.join(tmp_dir,'spark.json')
+            with open(spark_config_path,'w') as spark_config_file:
+                json.dump({'spark.sql.autoBroadcastJoinThreshold': '-1'},spark_config_file)
+            metrics_path = os.path.join(tmp_dir,'metrics.json')
+            creator.main(self.test_param(dataset1_path=current_path,dataset2_path=history_path,
+                spark_config_path=spark_config_path,metrics_path=metrics_path))
+            self.assert_expected()
+            with open(metrics_path) as metrics_file:
+                plan = json.load(metrics_file)['physical_plan']
+            self.assertIn('SortMergeJoin',plan)
+            self.assertNotIn('hashpartitioning(Primary_key',plan)
+
+class BackfillTestCase(GeneralTestCase):
+    """
+    Backfills the simple datasets over the week up to their Current_date, the partition of the
+    Current_date is expected to hold the same result as a run with the current dataset
+    """
+    def runTest(self):
+        print(f"{self.label} backfill")
+
+        if self.has_window():
+            self.skipTest('backfill does not support a history window')
+
+        current_rows = self.read_lines('input1.csv')[1]
+        key_dates = {(x.split(',')[0], x.split(',')[-1]) for x in self.read_lines('input2.csv')[1]}
+        if any((x.split(',')[0], x.split(',')[-1]) not in key_dates for x in current_rows):
+            self.skipTest('backfill only reports the keys with history on the Current_date')
+
+        month, day, year = current_rows[0].split(',')[-1].split('/')
+        current_date = datetime.date(int(year), int(month), int(day))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result_path = os.path.join(tmp_dir,'results')
+            creator.main(self.test_param(result_path=result_path,
+                backfill_from=(current_date - datetime.timedelta(days=7)).isoformat(),
+                backfill_to=current_date.isoformat()))
+            partition_path = os.path.join(result_path,f'As_of_date={current_date.isoformat()}')
+            csv_files = [x for x in os.listdir(partition_path) if x.endswith('.csv')]
+            self.assertEqual(len(csv_files),1)
+            self.assert_expected(os.path.join(partition_path,csv_files[0]))
+
+class IndexedTestCase(GeneralTestCase):
+    """
+    Runs the numpy engine on the history index of the simple datasets, built from a first
+    slice of the history with the second one appended
+    """
+    def runTest(self):
+        print(f"{self.label} indexed")
+
+        if self.has_window():
+            self.skipTest('history index does not support a history window')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            header, lines = self.read_lines('input2.csv')
+            index_path = os.path.join(tmp_dir,'input2.index')
+            for index, slice_lines in enumerate([lines[:len(lines) // 2], lines[len(lines) // 2:]]):
+                slice_path = os.path.join(tmp_dir,f'slice{index}.csv')
+                self.write_lines(slice_path,[header] + slice_lines)
+                history_index.build_index({
+                    'input_path': slice_path,
+                    'output_path': index_path,
+                    'attributes': self.attributes(),
+                    'mode': 'append'
+                })
+            creator.main(self.test_param(dataset2_path=index_path,engine='numpy'))
+            self.assert_expected()
+
+class MultiFileTestCase(GeneralTestCase):
+    """
+    Runs the simple datasets split into one gzip or bz2 history file by Cob_date with the
+    Cob_date column blanked out and a directory holding the gzip current file, the history is
+    passed as a glob pattern with the Cob_date taken from the file names
+    """
+    def runTest(self):
+        print(f"{self.label} multi file")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            current_path = os.path.join(tmp_dir,'current')
+            os.makedirs(current_path)
+            header, lines = self.read_lines('input1.csv')
+            self.write_lines(os.path.join(current_path,'input1.csv.gz'),[header] + lines,
+                gzip.open)
+            header, lines = self.read_lines('input2.csv')
+            days = {}
+            for line in lines:
+                *values, cob_date = line.split(',')
+                days.setdefault(cob_date, []).append(','.join(values + ['']))
+            for index, (cob_date, day_lines) in enumerate(sorted(days.items())):
+                day = datetime.datetime.strptime(cob_date, '%m/%d/%Y').strftime('%Y-%m-%d')
+                opener, extension = [(gzip.open, 'gz'), (bz2.open, 'bz2')][index % 2]
+                self.write_lines(os.path.join(tmp_dir,f'history_{day}.csv.{extension}'),
+                    [header] + day_lines, opener)
+            creator.main(self.test_param(dataset1_path=current_path,
+                dataset2_path=os.path.join(tmp_dir,'history_*.csv.*'),file_date='Yes'))
+            self.assert_expected()
+
+class ShardTestCase(GeneralTestCase):
+    """
+    Runs the simple datasets as three Primary_key shards and merges the shard results, the merged
+    result is expected to be the single run result. Unsorted shard runs are expected to be refused.
+    """
+    def runTest(self):
+        print(f"{self.label} shard {self.options}")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shard_paths = [os.path.join(tmp_dir,f'result_{x}.csv') for x in range(3)]
+            for index, shard_path in enumerate(shard_paths):
+                creator.main(self.test_param(result_path=shard_path,shard=[index, 3]))
+            merger.merge(shard_paths,self.data_path('result.csv'))
+            self.assert_expected()
+        self.assert_rejected('--shard','0/3','--sort','No')
+
+class EngineTestCase(GeneralTestCase):
+    """
+    Runs both engines on the simple datasets with a long attribute value and a key out of the
+    integer range, the numpy result is expected to be the same as the spark result. A parquet
+    history is expected to be refused by the numpy engine.
+    """
+    def runTest(self):
+        print(f"{self.label} engines")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = {}
+            for file_name in ['input1.csv', 'input2.csv']:
+                header, lines = self.read_lines(file_name)
+                first = lines[0].split(',')
+                if file_name == 'input1.csv':
+                    first[1] = 'Yes_but_pending_review'
+                    lines[0] = ','.join(first)
+                first[0] = '3000000000'
+                paths[file_name] = os.path.join(tmp_dir,file_name)
+                self.write_lines(paths[file_name],[header] + lines + [','.join(first)])
+            results = []
+            for engine in ['spark', 'numpy']:
+                result_path = os.path.join(tmp_dir,f'{engine}.csv')
+                creator.main(self.test_param(dataset1_path=paths['input1.csv'],
+                    dataset2_path=paths['input2.csv'],result_path=result_path,engine=engine))
+                with open(result_path) as result_file:
+                    results.append(result_file.read())
+            self.assertIn('Yes_but_pending_review',results[0])
+            self.assertNotIn('3000000000',results[0])
+            self.assertEqual(results[1],results[0])
+
+            # A parquet history detected from its files is refused by the numpy engine
+            parquet_path = os.path.join(tmp_dir,'input2.parquet')
+            converter.convert({
+                'input_path': self.data_path('input2.csv'),
+                'output_path': parquet_path,
+                'dataset': 'history',
+                'format': 'parquet',
+                'attributes': self.attributes()
+            })
+            self.assert_rejected('-ds2',parquet_path,'--engine','numpy')
+
+class WindowTestCase(GeneralTestCase):
+    """
+    Runs both engines on the simple datasets with a truncated history window, the results are
+    expected to be the expected results and the count of the current keys with no history in the
+    window is expected to be logged as they are not reported
+    """
+    def runTest(self):
+        print(f"{self.label} window")
+
+        if not self.has_window():
+            self.skipTest('no history window')
+        keys = [x.split(',')[0] for x in self.read_lines('input1.csv')[1]]
+        reported = [x.split(',')[0] for x in self.read_lines('expected.csv')[1]]
+        dropped = len(set(keys)) - len(set(reported))
+        for engine in ['spark','numpy']:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                result_path = os.path.join(tmp_dir,'result.csv')
+                with self.assertLogs(level='INFO') as logs:
+                    creator.main(self.test_param(result_path=result_path, engine=engine))
+                self.assert_expected(result_path)
+                self.assertIn(f'{dropped} current keys have no history in the window and are '
+                    'not reported','\n'.join(logs.output))
+
+class LibraryTestCase(GeneralTestCase):
+    """
+    Computes the simple datasets in process from the current dataset path and the history
+    dataframe, the dataframe rows are expected to be the expected result rows and the arrow
+    outputs to hold the same keys
+    """
+    def runTest(self):
+        print(f"{self.label} library")
+
+        options = self.test_options()
+        spark = creator.get_spark_session('DataSetCompare', {})
+        dataset2 = datasets.get_dataset(self.data_path('input2.csv'),
+            datasets.get_schema('Cob_date',self.attributes()), spark)
+        dataset1_path = self.data_path('input1.csv')
+        results = creator.compute(dataset1_path,dataset2,**options)
+        rows = [','.join(results.columns)] + [
+            ','.join(x.strftime('%m/%d/%Y') if isinstance(x,datetime.date) else str(x)
+                for x in row)
+            for row in results.collect()
+        ]
+        header, lines = self.read_lines('expected.csv')
+        self.assertEqual([header] + lines,rows)
+        with self.assertRaises(ValueError):
+            creator.compute(dataset1_path,dataset2,engine='numpy',**options)
+        with self.assertRaises(ValueError):
+            creator.compute(dataset1_path,dataset2,result_path='results.csv',**options)
+
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+        keys = [int(x.split(',')[0]) for x in lines]
+        table = creator.compute(dataset1_path,dataset2,'arrow',**options)
+        self.assertEqual(table.column('Primary_key').to_pylist(),keys)
+        batches = list(creator.compute(dataset1_path,dataset2,'batches',2,**options))
+        self.assertTrue(all(x.num_rows <= 2 for x in batches))
+        self.assertEqual(pyarrow.Table.from_batches(batches).column('Primary_key').to_pylist(),
+            keys)
+
+class DeltaTestCase(GeneralTestCase):
+    """
+    Runs the simple datasets against a previous result derived from the expected result with its
+    first row removed, the attribute of its second row flipped and an extra key, expected to
+    give an insert, an update and a delete
+    """
+    def runTest(self):
+        print(f"{self.label} delta")
+
+        header, rows = self.read_lines('expected.csv')
+        flipped = rows[1].split(',')
+        flipped[1] = 'No' if flipped[1] == 'Yes' else 'Yes'
+        removed = rows[-1].split(',')
+        removed[0] = '999999'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            previous_path = os.path.join(tmp_dir,'previous.csv')
+            self.write_lines(previous_path,[header, ','.join(flipped)] + rows[2:] +
+                [','.join(removed)])
+            result_path = os.path.join(tmp_dir,'delta.csv')
+            creator.main(self.test_param(result_path=result_path,
+                previous_result_path=previous_path))
+            with open(result_path) as result_file:
+                self.assertEqual(result_file.read().splitlines(), [
+                    'Operation,' + header,
+                    'insert,' + rows[0],
+                    'update,' + rows[1],
+                    'delete,' + ','.join(removed)
+                ])
+
+            # A key whose first Yes was the previous Current_date and a key Yes in the current
+            # dataset with no Yes in its history are both unchanged the next day
+            attributes = self.attributes()
+            flags = ['Yes'] + ['No'] * (len(attributes) - 1)
+            no_flags = ['No'] * len(attributes)
+            current_path = os.path.join(tmp_dir,'current.csv')
+            self.write_lines(current_path,[','.join(['Primary_key'] + attributes +
+                ['Current_date'])] + [','.join([x] + flags + ['01/03/2021']) for x in '12'])
+            history_path = os.path.join(tmp_dir,'history.csv')
+            self.write_lines(history_path,[','.join(['Primary_key'] + attributes +
+                ['Cob_date'])] + [','.join(x + [y]) for x, y in [
+                    (['1'] + no_flags, '01/01/2021'),
+                    (['1'] + flags, '01/02/2021'),
+                    (['1'] + flags, '01/03/2021'),
+                    (['2'] + no_flags, '01/02/2021'),
+                    (['2'] + no_flags, '01/03/2021')
+                ]])
+            self.write_lines(previous_path,[header] + [','.join([x] + flags + ['01/02/2021'] +
+                ['0'] * len(attributes)) for x in '12'])
+            creator.main(self.test_param(dataset1_path=current_path,dataset2_path=history_path,
+                result_path=result_path,previous_result_path=previous_path))
+            with open(result_path) as result_file:
+                self.assertEqual(result_file.read().splitlines(),['Operation,' + header])
+
+class CacheTestCase(GeneralTestCase):
+    """
+    Runs the simple datasets twice with the result cache, the second run is expected to copy the
+    cached result, which an edit of the restored result leaves intact, then once more with a
+    cache size of 0 which evicts every entry and does not store the result
+    """
+    def runTest(self):
+        print(f"{self.label} cache")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result_path = os.path.join(tmp_dir,'result.csv')
+            metrics_path = os.path.join(tmp_dir,'metrics.json')
+            cache_dir = os.path.join(tmp_dir,'cache')
+            test_param = self.test_param(result_path=result_path,metrics_path=metrics_path,
+                cache_dir=cache_dir)
+            for cache in ['miss', 'hit']:
+                creator.main(test_param)
+                with open(metrics_path) as metrics_file:
+                    self.assertEqual(json.load(metrics_file)['cache'],cache)
+                self.assert_expected(result_path)
+            with open(result_path,'a') as result_file:
+                result_file.write('edited\n')
+            creator.main(test_param)
+            self.assert_expected(result_path)
+            test_param.update({'cache_mb': 0, 'sort': 'No'})
+            with self.assertLogs(level='INFO') as logs:
+                creator.main(test_param)
+            self.assertIn('result not cached','\n'.join(logs.output))
+            self.assertEqual(os.listdir(cache_dir),[])
+            self.assertEqual(verifier.compare(result_path,self.data_path('expected.csv')),[])
+
+class VerifierTestCase(GeneralTestCase):
+    """
+    Verifies results derived from the expected result, the reversed rows split into part files
+    are expected to match and the result with a flipped row, a missing row and an extra key to
+    report these three keys
+    """
+    def runTest(self):
+        print(f"{self.label} verifier")
+
+        header, rows = self.read_lines('expected.csv')
+        expected_path = self.data_path('expected.csv')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            parts_path = os.path.join(tmp_dir,'parts')
+            os.mkdir(parts_path)
+            reversed_rows = rows[::-1]
+            for index in range(2):
+                self.write_lines(os.path.join(parts_path,f'part-{index:05d}.csv'),
+                    [header] + reversed_rows[index::2])
+            self.assertEqual(verifier.compare(parts_path,expected_path),[])
+
+            flipped = rows[0].split(',')
+            flipped[1] = 'No' if flipped[1] == 'Yes' else 'Yes'
+            extra = rows[0].split(',')
+            extra[0] = '999999'
+            result_path = os.path.join(tmp_dir,'result.csv')
+            self.write_lines(result_path,[header, ','.join(extra)] + rows[2:] +
+                [','.join(flipped)])
+            self.assertEqual(verifier.compare(result_path,expected_path,buckets=2),
+                sorted([flipped[0], rows[1].split(',')[0], '999999']))
+            self.write_lines(result_path,[header.lower()] + rows)
+            self.assertEqual(verifier.compare(result_path,expected_path),['header'])
+
+class ServerTestCase(GeneralTestCase):
+    """
+    Posts the simple datasets jobs to the job server, the current dataset is expected to come
+    from the server cache on the second job and to be parsed again once its modification time
+    then its size changed, the least recently used datasets to be released beyond the bound. The
+    creator.main argument names are expected to be accepted as job keys.
+    """
+    def runTest(self):
+        print(f"{self.label} server")
+
+        class Handler(server.JobHandler):
+            dataset_cache = {}
+
+        def post_job(job):
+            request = urllib.request.Request(f"http://127.0.0.1:{job_server.server_port}/jobs",
+                data=json.dumps(job).encode('utf8'),method='POST')
+            with urllib.request.urlopen(request) as response:
+                self.assertEqual(json.load(response)['status'],'done')
+            self.assert_expected(job['result_path'])
+            return [x[1] for y, x in Handler.dataset_cache.items()
+                if y[0] == os.path.abspath(current_path)][0]
+
+        job_server = server.HTTPServer(('127.0.0.1',0),Handler)
+        threading.Thread(target=job_server.serve_forever,daemon=True).start()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                current_path = os.path.join(tmp_dir,'input1.csv')
+                shutil.copy(self.data_path('input1.csv'),current_path)
+                job = self.test_param(dataset1_path=current_path,
+                    result_path=os.path.join(tmp_dir,'result.csv'))
+                job.pop('show')
+                dataset = post_job(job)
+                metrics_path = os.path.join(tmp_dir,'metrics.json')
+                self.assertIs(post_job(dict(job,metrics_path=metrics_path)),dataset)
+                self.assertTrue(os.path.exists(metrics_path))
+
+                stat = os.stat(current_path)
+                os.utime(current_path,ns=(stat.st_atime_ns,stat.st_mtime_ns + 10**9))
+                modified_dataset = post_job(job)
+                self.assertIsNot(modified_dataset,dataset)
+
+                stat = os.stat(current_path)
+                with open(current_path,'a') as current_file:
+                    current_file.write('\n')
+                os.utime(current_path,ns=(stat.st_atime_ns,stat.st_mtime_ns))
+                dataset = post_job(job)
+                self.assertIsNot(dataset,modified_dataset)
+
+                with urllib.request.urlopen(
+                    f"http://127.0.0.1:{job_server.server_port}/status") as response:
+                    status = json.load(response)
+                self.assertEqual(status['cached_datasets'],2)
+                self.assertEqual(status['cached_input_bytes'],os.path.getsize(current_path) +
+                    os.path.getsize(self.data_path('input2.csv')))
+
+                # The least recently used datasets are released beyond the cache bound
+                spark = creator.get_spark_session('DataSetCompare', {})
+                for index in range(creator.DATASET_CACHE_ENTRIES):
+                    creator.get_cached_dataset(Handler.dataset_cache,current_path,index,
+                        lambda: spark.createDataFrame([(1,)],['Primary_key']))
+                self.assertEqual(len(Handler.dataset_cache),creator.DATASET_CACHE_ENTRIES)
+                self.assertFalse(dataset.is_cached)
+        finally:
+            job_server.shutdown()
+            job_server.server_close()
+
+class MetricsTestCase(GeneralTestCase):
+    """
+    Runs the simple datasets with the metrics report and the driver profile, the report is
+    expected to list the spark stages of each stage with their sums as the stage totals and the
+    profile to be readable by pstats
+    """
+    def runTest(self):
+        print(f"{self.label} metrics")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            metrics_path = os.path.join(tmp_dir,'metrics.json')
+            profile_path = os.path.join(tmp_dir,'creator.prof')
+            creator.main(self.test_param(metrics_path=metrics_path,profile_path=profile_path))
+            self.assert_expected()
+            with open(metrics_path) as metrics_file:
+                report = json.load(metrics_file)
+            self.assertEqual(report['options']['metrics_path'],metrics_path)
+            self.assertIn('== Physical Plan ==',report['physical_plan'])
+            stages = {x['name']: x for x in report['stages']}
+            self.assertTrue({'session','plan','export'} <= set(stages))
+            spark_stages = stages['export']['spark_stages']
+            self.assertTrue(spark_stages)
+            self.assertIn('COMPLETE',[x['status'] for x in spark_stages])
+            for spark_stage in spark_stages:
+                self.assertIn(spark_stage['status'],['COMPLETE','SKIPPED'])
+                self.assertIsInstance(spark_stage['stage_id'],int)
+                if spark_stage['status'] == 'COMPLETE':
+                    self.assertTrue(spark_stage['name'])
+                    self.assertGreaterEqual(spark_stage['duration_ms'],0)
+            for name in metrics.SPARK_STAGE_METRICS.values():
+                self.assertEqual(stages['export'][name],sum(x[name] for x in spark_stages))
+            self.assertGreater(stages['export']['input_rows'],0)
+            self.assertGreater(stages['export']['shuffle_write_bytes'],0)
+
+            self.assertTrue(report['profile'])
+            self.assertTrue(all(x['calls'] > 0 for x in report['profile']))
+            functions = pstats.Stats(profile_path).stats
+            self.assertTrue(any(x[2] == 'run_spark' for x in functions))
+
+class QualityTestCase(GeneralTestCase):
+    """
+    Runs the data quality checks on the simple datasets with an invalid and a decimal key, an
+    invalid date and attribute history row, a duplicated history row and a current key with no history added, expected to
+    quarantine them and give the expected result, then to stop the run with a zero threshold
+    """
+    def runTest(self):
+        print(f"{self.label} quality")
+
+        if self.has_window():
+            self.skipTest('quality checks do not support a history window')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            current = list(self.read_lines('input1.csv'))
+            history = list(self.read_lines('input2.csv'))
+            row = history[1][0].split(',')
+            invalid_rows = [
+                ','.join(['abc'] + row[1:]),
+                ','.join([row[0] + '.5'] + row[1:]),
+                ','.join(row[:-1] + ['13/45/2021']),
+                ','.join(row[:1] + ['Maybe'] + row[2:]),
+                history[1][0]
+            ]
+            current_path = os.path.join(tmp_dir,'input1.csv')
+            history_path = os.path.join(tmp_dir,'input2.csv')
+            self.write_lines(current_path,[current[0]] + current[1] + ['999999' + current[1][0][
+                current[1][0].index(','):]])
+            self.write_lines(history_path,[history[0]] + history[1] + invalid_rows)
+            result_path = os.path.join(tmp_dir,'result.csv')
+            quarantine_path = os.path.join(tmp_dir,'quarantine.csv')
+            test_param = self.test_param(dataset1_path=current_path,dataset2_path=history_path,
+                result_path=result_path,quality='Yes',quarantine_path=quarantine_path,
+                quality_threshold=1.0,cache_dir=os.path.join(tmp_dir,'cache'))
+            # The second run restores the result and the quarantine file from the result cache
+            for _ in range(2):
+                creator.main(test_param)
+                self.assert_expected(result_path)
+                with open(quarantine_path) as quarantine_file:
+                    reasons = sorted(x.split(',')[1] for x in quarantine_file.readlines()[1:])
+                os.remove(quarantine_path)
+                first_attribute = self.attributes()[0]
+                self.assertEqual(reasons, sorted(['duplicate key date',
+                    f'invalid {first_attribute}', 'invalid date', 'invalid key', 'invalid key',
+                    'no history']))
+
+            test_param['quality_threshold'] = 0.0
+            with self.assertRaises(quality.QualityError):
+                creator.main(test_param)
+
+class SparkConfigTestCase(GeneralTestCase):
+    """
+    Picks the spark profile of sparse input files of several sizes, a compressed file is expected
+    to count for its estimated decompressed size, the large profile to scale its shuffle
+    partitions with the input size and the json config file to override the profile settings
+    """
+    def runTest(self):
+        print("spark config")
+
+        def sparse_file(file_path, file_bytes):
+            with open(file_path,'wb') as sparse:
+                sparse.truncate(file_bytes)
+            return file_path
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            small_path = sparse_file(os.path.join(tmp_dir,'small.csv'),
+                creator.SMALL_INPUT_BYTES // 20)
+            compressed_path = sparse_file(os.path.join(tmp_dir,'compressed.csv.gz'),
+                creator.SMALL_INPUT_BYTES // 5)
+            large_path = sparse_file(os.path.join(tmp_dir,'large.csv'),
+                creator.LARGE_PARTITION_BYTES * 500)
+            self.assertEqual(creator.get_spark_config([small_path,small_path]),
+                creator.SPARK_PROFILES['small'])
+            self.assertEqual(creator.get_spark_config([small_path,compressed_path]),
+                creator.SPARK_PROFILES['large'])
+            self.assertEqual(creator.get_spark_config([large_path],'small'),
+                creator.SPARK_PROFILES['small'])
+            spark_config = creator.get_spark_config([large_path])
+            self.assertEqual(spark_config['spark.sql.shuffle.partitions'],'500')
+            self.assertEqual(creator.get_spark_config([small_path],'large'),
+                creator.SPARK_PROFILES['large'])
+
+            config_path = os.path.join(tmp_dir,'spark.json')
+            with open(config_path,'w') as config_file:
+                json.dump({'spark.sql.shuffle.partitions': 8,
+                    'spark.executor.memory': '2g'},config_file)
+            spark_config = creator.get_spark_config([large_path],'auto',config_path)
+            self.assertEqual(spark_config['spark.sql.shuffle.partitions'],'8')
+            self.assertEqual(spark_config['spark.executor.memory'],'2g')
+            self.assertEqual(spark_config['spark.driver.memory'],
+                creator.SPARK_PROFILES['large']['spark.driver.memory'])
+
+class BenchmarkTestCase(GeneralTestCase):
+    """
+    Compares a benchmark report with a baseline report, the slower record beyond the tolerance
+    and the incorrect record are expected as regressions and the csv report to hold one column
+    by stage
+    """
+    def runTest(self):
+        print("benchmark baseline")
+
+        def record(variant, wall_seconds, correct=True):
+            return {'size': 'small', 'variant': variant, 'current_rows': 3000,
+                'history_rows': 45000, 'exit_code': 0, 'correct': correct,
+                'wall_seconds': wall_seconds, 'peak_rss_mb': 100.0,
+                'rows_per_second': round(45000 / wall_seconds),
+                'stages': {'plan': 0.5, 'export': wall_seconds - 1}}
+
+        baseline = {'commit': 'abc1234', 'date': '2022-02-04T10:00:00',
+            'records': [record(x, 10.0) for x in benchmarks_run.VARIANTS]}
+        report = {'commit': 'def5678', 'date': '2022-02-05T10:00:00', 'records': [
+            record('spark-aggregate', 12.0),
+            record('spark-legacy', 13.0),
+            record('numpy', 5.0, False)
+        ]}
+        self.assertEqual(benchmarks_run.compare_reports(report,baseline,1.25), [
+            'small spark-legacy 10.0s -> 13.0s (abc1234 -> def5678)',
+            'small numpy result differs from the expected result'
+        ])
+        self.assertEqual(benchmarks_run.compare_reports(baseline,baseline,1.25),[])
+        self.assertEqual(len(benchmarks_run.compare_reports(report,baseline,1.1)),3)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            report_path = os.path.join(tmp_dir,'report.json')
+            benchmarks_run.write_report(report,report_path)
+            with open(report_path) as report_file:
+                self.assertEqual(json.load(report_file),report)
+            with open(os.path.join(tmp_dir,'report.csv')) as csv_file:
+                rows = list(csv.DictReader(csv_file))
+            self.assertEqual([x['variant'] for x in rows],list(benchmarks_run.VARIANTS))
+            self.assertEqual(rows[1]['stage_export_seconds'],'12.0')
+            self.assertEqual(rows[2]['correct'],'False')
+
+class GeneratorTestCase(GeneralTestCase):
+    """
+    Runs the test data generator command line on a small seeded random volume data set with
+    one and two worker processes, the history is expected to be the same and the creator
+    result to match the generated expected result
+    """
+    def runTest(self):
+        print("generator")
+
+        generator_path = os.path.join(os.path.dirname(TEST_ROOT),'test_data_generator.py')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for workers in [1, 2]:
+                data_folder = os.path.join(tmp_dir,f'workers{workers}')
+                subprocess.run([sys.executable,generator_path,'--name','random','--current','30',
+                    '--days','6','--workers',str(workers),'--distribution','random','--seed','7',
+                    '--data_folder',data_folder], cwd=tmp_dir, check=True,
+                    stdout=subprocess.DEVNULL)
+            self.test_folder = os.path.join(tmp_dir,'workers2')
+            self.label = 'random'
+            self.assertEqual(self.md5(self.data_path('input2.csv')),
+                self.md5(os.path.join(tmp_dir,'workers1','random','input2.csv')))
+            _, lines = self.read_lines('input2.csv')
+            self.assertEqual(len(lines),30 * 7)
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir,'tests','simple-data','sample',
+                'expected.csv')))
+
+            creator.main(self.test_param(engine='numpy'))
+            self.assertEqual(verifier.compare(self.data_path('result.csv'),
+                self.data_path('expected.csv')),[])
 
 def load_tests(loader, tests, pattern):
     """
@@ -72,8 +894,37 @@ def load_tests(loader, tests, pattern):
     print(f"Simple Datasets: {simple_test_list}")
     for test_label in simple_test_list:
         test_cases.addTest(GeneralTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(GeneralTestCase('runTest', test_label,'simple',{'plan': 'legacy'}))
+        test_cases.addTest(GeneralTestCase('runTest', test_label,'simple',{'engine': 'numpy'}))
+        test_cases.addTest(GeneralTestCase('runTest', test_label,'simple',{'sort': 'No'}))
+        test_cases.addTest(IncrementalTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(ColumnarTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(OutputTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(EncodedTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(EncodedTestCase('runTest', test_label,'simple',{'plan': 'legacy'}))
+        test_cases.addTest(BucketedTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(BackfillTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(IndexedTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(MultiFileTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(MultiFileTestCase('runTest', test_label,'simple',{'engine': 'numpy'}))
+        test_cases.addTest(ShardTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(ShardTestCase('runTest', test_label,'simple',{'engine': 'numpy'}))
+        test_cases.addTest(EngineTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(WindowTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(LibraryTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(VerifierTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(DeltaTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(CacheTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(MetricsTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(ServerTestCase('runTest', test_label,'simple'))
+        test_cases.addTest(QualityTestCase('runTest', test_label,'simple'))
+    test_cases.addTest(SparkConfigTestCase('runTest'))
+    test_cases.addTest(BenchmarkTestCase('runTest'))
+    test_cases.addTest(GeneratorTestCase('runTest'))
     print(dynamic_test_list)
     print(f"Dynamic Datasets: {dynamic_test_list}")
     for test_label in dynamic_test_list:
         test_cases.addTest(GeneralTestCase('runTest', test_label,'dynamic'))
+        test_cases.addTest(GeneralTestCase('runTest', test_label,'dynamic',{'plan': 'legacy'}))
+        test_cases.addTest(GeneralTestCase('runTest', test_label,'dynamic',{'engine': 'numpy'}))
     return test_cases
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""
+# Title : Code Assessment - Result Verifier
+# Description : Order insensitive streaming comparison of a result with the expected result
+# Author : David Gevry
+# Date : 2022-02-04
+# Version : 1.0
+"""
+
+import textwrap
+import sys
+import os
+import argparse
+import hashlib
+import tempfile
+from collections import Counter
+
+BUCKETS = 64
+MAX_REPORTED_KEYS = 20
+
+def parse_input():
+    """
+    Parse script arguments
+    """
+    parser =  argparse.ArgumentParser(
+        prog=sys.argv[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+example:
+    # Compare a result csv file or multi-part directory with the expected csv file
+    # regardless of the row order
+    python3 ./verifier.py -r results.csv -e expected.csv
+    ''')
+    )
+
+    parser.add_argument("-r","--result_path", help="Result csv file or part files directory path",
+        required=True)
+    parser.add_argument("-e","--expected_path", help="Expected csv file or part files directory "
+        "path", required=True)
+    parser.add_argument("-b","--buckets", help="Number of key buckets spilled to disk when the "
+        "files differ", type=int, default=BUCKETS, required=False)
+    args = parser.parse_args()
+    return args
+
+def iter_lines(csv_path):
+    """
+    Yields the header then the data lines of a csv file or of the part files of a directory,
+    each part file repeating the header
+    """
+    if os.path.isdir(csv_path):
+        csv_files = sorted(
+            os.path.join(csv_path, x) for x in os.listdir(csv_path)
+            if not x.startswith(("_", ".")) and x.endswith(".csv")
+        )
+    else:
+        csv_files = [csv_path]
+    header = None
+    for csv_file in csv_files:
+        with open(csv_file, "rb") as part_file:
+            first_line = part_file.readline().rstrip(b"\r\n")
+            if header is None:
+                header = first_line
+                yield header
+            elif first_line and first_line != header:
+                yield first_line
+            for line in part_file:
+                yield line.rstrip(b"\r\n")
+    if header is None:
+        yield b""
+
+def get_digest(csv_path):
+    """
+    Returns the header, the row count and an order insensitive digest of the rows, the sum of
+    the row hashes modulo 2^64
+    """
+    lines = iter_lines(csv_path)
+    header = next(lines)
+    count = 0
+    digest = 0
+    for line in lines:
+        count += 1
+        digest = (digest + int.from_bytes(
+            hashlib.blake2b(line, digest_size=8).digest(), "little")) % (1 << 64)
+    return header, count, digest
+
+def get_key(line):
+    """
+    Returns the key, first field, of a csv line
+    """
+    return line.split(b",", 1)[0]
+
+def compare(result_path, expected_path, buckets=BUCKETS):
+    """
+    Compares the rows of the result and expected csv regardless of their order and returns the
+    list of keys whose rows differ, empty when they match. The files are first compared by their
+    digest, on a mismatch both are split by key hash into bucket files compared one at a time.
+    """
+    result_digest = get_digest(result_path)
+    expected_digest = get_digest(expected_path)
+    if result_digest == expected_digest:
+        return []
+    if result_digest[0] != expected_digest[0]:
+        return ["header"]
+
+    with tempfile.TemporaryDirectory(suffix="tmp") as tmp_dir:
+        for name, csv_path in [("result", result_path), ("expected", expected_path)]:
+            bucket_files = [
+                open(os.path.join(tmp_dir, f"{name}-{x}"), "wb") # pylint: disable=consider-using-with
+                for x in range(buckets)
+            ]
+            try:
+                lines = iter_lines(csv_path)
+                next(lines)
+                for line in lines:
+                    bucket = int.from_bytes(
+                        hashlib.blake2b(get_key(line), digest_size=4).digest(), "little")
+                    bucket_files[bucket % buckets].write(line + b"\n")
+            finally:
+                for bucket_file in bucket_files:
+                    bucket_file.close()
+
+        differing_keys = set()
+        for bucket in range(buckets):
+            rows = []
+            for name in ["result", "expected"]:
+                with open(os.path.join(tmp_dir, f"{name}-{bucket}"), "rb") as bucket_file:
+                    rows.append(Counter(line.rstrip(b"\n") for line in bucket_file))
+            differing_keys.update(get_key(x) for x in (rows[0] - rows[1]) + (rows[1] - rows[0]))
+    return sorted(x.decode("utf8", "replace") for x in differing_keys)
+
+def validate_args(args):
+    """
+    Validates the input arguments to check file paths exists
+    """
+    call_error_found = False
+    if not os.path.exists(args.result_path):
+        print("result_path is required to exist")
+        call_error_found = True
+    if not os.path.exists(args.expected_path):
+        print("expected_path is required to exist")
+        call_error_found = True
+    if args.buckets < 1:
+        print("buckets is required to be at least 1")
+        call_error_found = True
+    if call_error_found:
+        sys.exit(1)
+    return {
+            'result_path': args.result_path,
+            'expected_path': args.expected_path,
+            'buckets': args.buckets
+        }
+
+if __name__ == '__main__':
+    verifier_args = validate_args(parse_input())
+    keys = compare(verifier_args["result_path"], verifier_args["expected_path"],
+        verifier_args["buckets"])
+    if keys:
+        print(f"{len(keys)} keys differ, first keys: {keys[:MAX_REPORTED_KEYS]}")
+        sys.exit(1)
+    print("result matches the expected result")
+    sys.exit()